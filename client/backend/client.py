@@ -5,6 +5,7 @@ import threading
 import json
 import logging
 from .handler import handle_message
+from .framing import FrameDecoder, FrameError, encode_frame
 
 class Client(QObject):
     """
@@ -24,6 +25,7 @@ class Client(QObject):
     error_received = pyqtSignal(str, str)
     room_added = pyqtSignal()
     public_message_received = pyqtSignal(str, str, str)
+    history_received = pyqtSignal(str, list, bool)
     connection_failed = pyqtSignal()
 
     def __init__(self, username:str, password:str, server:str, port:int):
@@ -56,6 +58,9 @@ class Client(QObject):
 
         ## Create a new TCP socket
         self.__socket_tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        ## Create the decoder of the frames received from the server
+        self.decoder = FrameDecoder()
         
     def connect(self, register:bool=False):
         """
@@ -98,14 +103,23 @@ class Client(QObject):
         while not self.listen_flag:
             try:
                 ## Try to receive data from the socket
-                data = socket.recv(1024).decode()
+                data = socket.recv(65536)
+
+                ## If no data was received, the server closed the connection
+                if not data:
+                    ## Only a failure if the client isn't closing itself
+                    if not self.listen_flag:
+                        logging.error("Connection closed by the server")
+                        self.connection_failed.emit()
+                    break
 
-                ## If data was received
-                if data:
-                    logging.info('Data received from server.')
+                logging.info('Data received from server.')
+
+                ## Handle every message completed by the received data
+                for frame in self.decoder.feed(data):
                     try:
                         ## Try to parse the data as JSON
-                        message = json.loads(data)
+                        message = json.loads(frame)
 
                         ## Handle the message
                         handle_message(self, message)
@@ -115,6 +129,11 @@ class Client(QObject):
             except timeout:
                 ## If a timeout occurs, continue to the next iteration of the loop
                 continue
+            except (FrameError, UnicodeDecodeError) as e:
+                ## If the server sent an invalid frame, log an error and emit a connection failed signal
+                logging.error(f"Invalid frame: {e}")
+                self.connection_failed.emit()
+                break
             except ConnectionResetError:
                 ## If the connection is reset, log an error and emit a connection failed signal
                 logging.error("Connection reset")
@@ -142,9 +161,9 @@ class Client(QObject):
         data = {'type':'pending_room',
                 'room':room}
 
-        ## Convert the dictionary to a JSON string and encode it to bytes
+        ## Convert the dictionary to a JSON string and encode it into a frame
         ## Then send it to the server using the TCP socket
-        self.__socket_tcp.send(json.dumps(data).encode())
+        self.__socket_tcp.sendall(encode_frame(json.dumps(data)))
 
     def send_signup_info(self):
         """
@@ -155,9 +174,9 @@ class Client(QObject):
                 'username':self.username,
                 'password':self.password}
 
-        ## Convert the dictionary to a JSON string and encode it to bytes
+        ## Convert the dictionary to a JSON string and encode it into a frame
         ## Then send it to the server using the TCP socket
-        self.__socket_tcp.send(json.dumps(data).encode())
+        self.__socket_tcp.sendall(encode_frame(json.dumps(data)))
 
     def send_login_info(self):
         """
@@ -168,9 +187,9 @@ class Client(QObject):
                 'username':self.username,
                 'password':self.password}
 
-        ## Convert the dictionary to a JSON string and encode it to bytes
+        ## Convert the dictionary to a JSON string and encode it into a frame
         ## Then send it to the server using the TCP socket
-        self.__socket_tcp.send(json.dumps(data).encode())
+        self.__socket_tcp.sendall(encode_frame(json.dumps(data)))
     
     def send_public_message(self, room:str, message:str):
         """
@@ -186,10 +205,31 @@ class Client(QObject):
                 'room':room,
                 'message':message}
 
-        ## Convert the dictionary to a JSON string and encode it to bytes
+        ## Convert the dictionary to a JSON string and encode it into a frame
         ## Then send it to the server using the TCP socket
-        self.__socket_tcp.send(json.dumps(data).encode())
+        self.__socket_tcp.sendall(encode_frame(json.dumps(data)))
     
+    def send_history_request(self, room:str, before:int=None, limit:int=50):
+        """
+        Request a page of the messages of a room to the server.
+
+        :param room: The name of the room.
+        :type room: str
+        :param before: The id of the oldest message already received, None for the latest messages.
+        :type before: int
+        :param limit: The maximum number of messages.
+        :type limit: int
+        """
+        ## Create a dictionary with the type of the message, the room name, and the page wanted
+        data = {'type':'history',
+                'room':room,
+                'before':before,
+                'limit':limit}
+
+        ## Convert the dictionary to a JSON string and encode it into a frame
+        ## Then send it to the server using the TCP socket
+        self.__socket_tcp.sendall(encode_frame(json.dumps(data)))
+
     def send_private_message(self, username:str, message:str):
         """
         Send a private message to a user.
@@ -205,9 +245,9 @@ class Client(QObject):
                         'user':self.username,
                         'message':message}
 
-        ## Convert the dictionary to a JSON string and encode it to bytes
+        ## Convert the dictionary to a JSON string and encode it into a frame
         ## Then send it to the server using the TCP socket
-        self.__socket_tcp.send(json.dumps(private_message).encode())
+        self.__socket_tcp.sendall(encode_frame(json.dumps(private_message)))
     
     def close(self):
         """
@@ -221,7 +261,7 @@ class Client(QObject):
             self.__socket_tcp.getpeername()
 
             ## Send a disconnect message to the server
-            self.__socket_tcp.send(json.dumps({'type':'disconnect'}).encode())
+            self.__socket_tcp.sendall(encode_frame(json.dumps({'type':'disconnect'})))
         except OSError:
             ## If the socket is not connected, pass
             logging.error("Socket is not connected")
@@ -0,0 +1,71 @@
+import struct
+
+## Every frame starts with the size of its payload, as a 4 bytes big-endian unsigned integer
+HEADER = struct.Struct('!I')
+
+## Frames bigger than this are refused, a client can't make the other side buffer without limit
+MAX_FRAME_SIZE = 1024 * 1024
+
+class FrameError(ValueError):
+    """
+    Raised when a frame announces a size bigger than the allowed maximum.
+    """
+
+def encode_frame(data:str) -> bytes:
+    """
+    Encode a message into a frame: the size of the UTF-8 payload followed by the payload.
+
+    :param str data: The message.
+    :return: The frame.
+    :rtype: bytes
+    """
+    payload = data.encode('utf-8')
+    return HEADER.pack(len(payload)) + payload
+
+class FrameDecoder:
+    """
+    Incremental decoder of frames. Received bytes are appended to a buffer which is reused between reads,
+    every complete frame is extracted in a single pass and incomplete ones are kept for the next read.
+
+    :ivar bytearray buffer: The bytes received but not decoded yet.
+    :ivar int max_size: The maximum size of a frame payload.
+    """
+    def __init__(self, max_size:int=MAX_FRAME_SIZE):
+        """
+        Initialize the FrameDecoder with an empty buffer.
+
+        :param int max_size: The maximum size of a frame payload.
+        """
+        self.buffer = bytearray()
+        self.max_size = max_size
+
+    def feed(self, data:bytes) -> list:
+        """
+        Add received bytes to the buffer and return the messages of the frames now complete.
+
+        :param bytes data: The received bytes.
+        :return: The decoded messages, possibly empty.
+        :rtype: list
+        :raises FrameError: If a frame is bigger than the maximum size.
+        :raises UnicodeDecodeError: If a payload isn't valid UTF-8.
+        """
+        self.buffer += data
+        messages = []
+        offset = 0
+        end = len(self.buffer)
+
+        with memoryview(self.buffer) as view:
+            while end - offset >= HEADER.size:
+                (size,) = HEADER.unpack_from(view, offset)
+                if size > self.max_size:
+                    raise FrameError(f"Frame of {size} bytes exceeds the maximum of {self.max_size} bytes")
+                start = offset + HEADER.size
+                if end - start < size:
+                    ## Incomplete frame, wait for more data
+                    break
+                messages.append(str(view[start:start + size], 'utf-8'))
+                offset = start + size
+
+        ## Drop the decoded frames, keeping the beginning of the next one
+        del self.buffer[:offset]
+        return messages
@@ -25,6 +25,7 @@ def handle_message(client:'Client', message:dict):
                         'pending_room': handle_pending_room_message,
                         'public': handle_public_message,
                         'private': handle_private_message,
+                        'history': handle_history_message,
                         'disconnect': handle_disconnect_message}
 
     ## Call the corresponding handler
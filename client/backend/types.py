@@ -214,6 +214,28 @@ def handle_private_message(client:'Client', message:dict):
         logging.error(f"Error sending private: {reason}")
         client.error_received.emit(f"Error sending private", reason)
 
+def handle_history_message(client:'Client', message:dict):
+    """
+    Handle a page of the history of a room from the server.
+
+    :param client: The client.
+    :type client: Client
+    :param message: The message.
+    :type message: dict
+    """
+    ## If the status of the message is 'ok'
+    if message['status'] == 'ok':
+        ## Emit a history received signal with the room, the messages (newest first) and if older ones exist
+        client.history_received.emit(message['room'], message['messages'], message['more'])
+    ## If the status of the message is 'error'
+    elif message['status'] == 'error':
+        ## Get the reason from the message
+        reason = message['reason']
+
+        ## Emit an error received signal from the client with the error message and the reason
+        logging.error(f"History error: {reason}")
+        client.error_received.emit("Error loading history", reason)
+
 def handle_disconnect_message(client:'Client', message:dict):
     """
     Handle a disconnect message from the client.
@@ -42,6 +42,9 @@ class ChatWindow(QMainWindow):
         ## Initialize a dictionary to store messages
         self.messages = {}
 
+        ## Initialize a set of the rooms whose history was requested
+        self.history_loaded = set()
+
         ## Add default rooms
         self.add_room("home")
         self.add_room("private")
@@ -156,6 +159,11 @@ class ChatWindow(QMainWindow):
                 if title in self.messages:
                     for message in self.messages[title]:
                         self.textBrowser.append(message)
+
+                ## The first time the room is opened, ask the server for its latest messages
+                if title not in self.history_loaded:
+                    self.history_loaded.add(title)
+                    self.client.send_history_request(title)
         else:
             logging.warning("No widget set for item")
 
@@ -270,6 +278,9 @@ class ChatWindow(QMainWindow):
         ## Connect the public_message_received signal from the client to the display_public_message method
         self.client.public_message_received.connect(self.display_public_message)
 
+        ## Connect the history_received signal from the client to the display_history method
+        self.client.history_received.connect(self.display_history)
+
         ## Return the created widget
         return widget
 
@@ -352,6 +363,32 @@ class ChatWindow(QMainWindow):
         if room == self.subwindow.windowTitle():
             self.textBrowser.append(message)
 
+    @pyqtSlot(str, list, bool)
+    def display_history(self, room:str, messages:list, more:bool):
+        """
+        Display the history of a room before the messages already received.
+
+        :param room: The room of the messages.
+        :type room: str
+        :param messages: The messages, newest first.
+        :type messages: list
+        :param more: True if older messages exist.
+        :type more: bool
+        """
+        ## Format the messages as "sender: content", oldest first
+        history = [f"{message['user']}: {message['message']}" for message in reversed(messages)]
+
+        ## Put the history before the messages received, skipping the ones already written to the database
+        received = self.messages.get(room, [])
+        overlap = next((n for n in range(min(len(received), len(history)), 0, -1) if history[-n:] == received[:n]), 0)
+        self.messages[room] = history + received[overlap:]
+
+        ## If the room is the current room, display all its messages again
+        if room == self.subwindow.windowTitle():
+            self.textBrowser.clear()
+            for message in self.messages[room]:
+                self.textBrowser.append(message)
+
     def closeEvent(self, event:'QCloseEvent'):
         """
         Handle the close event of the window.
@@ -0,0 +1,94 @@
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+from server.database import DatabaseConnection, DEFAULT_URL
+
+def benchmark(url:str, count:int, batch_size:int, synchronous:str) -> dict:
+    """
+    Measure the time to write a public message with a database backend.
+
+    The messages are written one per transaction, like insert_message, then by batches, like the
+    write-behind MessageWriter. The messages written, and the benchmark user if it was created for the
+    benchmark, are deleted at the end.
+
+    :param str url: The database URL.
+    :param int count: The number of messages written by each method.
+    :param int batch_size: The number of messages per transaction of the batches.
+    :param str synchronous: The synchronous level of a SQLite database.
+    :return: The latencies in milliseconds per message.
+    :rtype: dict
+    """
+    database = DatabaseConnection()
+    database.connect(url, sqlite_synchronous=synchronous)
+    ## Fail at once if the database can't be reached
+    database.engine.connect().close()
+    database.warm()
+    user, room = 'benchmark', 'Blabla'
+    created = not database.user_exists(user)
+    if created:
+        database.insert_user(user, 'benchmark', '127.0.0.1', datetime.datetime.now())
+
+    try:
+        ## One message per transaction
+        latencies = []
+        for i in range(count):
+            start = time.perf_counter()
+            database.insert_message(user, room, datetime.datetime.now(), f"message {i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+
+        ## Batches of messages in a transaction
+        start = time.perf_counter()
+        for first in range(0, count, batch_size):
+            database.insert_messages([{'user':user,
+                                       'room':room,
+                                       'date_message':datetime.datetime.now(),
+                                       'body':f"message {i}"} for i in range(first, min(first + batch_size, count))])
+        batched = (time.perf_counter() - start) * 1000 / count
+    finally:
+        database.execute_sql_query("DELETE FROM messages WHERE user = :user", {'user':user})
+        if created:
+            database.execute_sql_query("DELETE FROM users WHERE name = :name", {'name':user})
+        database.close()
+
+    return {'mean':statistics.mean(latencies),
+            'p50':latencies[len(latencies) // 2],
+            'p99':latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+            'batched':batched}
+
+def main():
+    """
+    Main function of the benchmark.
+
+    This function parses command line arguments for the databases and the number of messages, and prints the
+    latency per message of each database. By default the MySQL server of the chat and a temporary SQLite file
+    are compared.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark of the message writes of the database backends.')
+    parser.add_argument('--database', type=str, action='append',
+                        help='Database URL, can be repeated (the MySQL server and a temporary SQLite file by default)')
+    parser.add_argument('-n', '--count', type=int, default=1000, help='Number of messages written')
+    parser.add_argument('--batch', type=int, default=100, help='Number of messages per transaction of the batches')
+    parser.add_argument('--sqlite-synchronous', type=str, choices=['OFF', 'NORMAL', 'FULL', 'EXTRA'], default='NORMAL',
+                        help='Synchronous level of the SQLite databases')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        urls = args.database or [DEFAULT_URL, 'sqlite:///' + os.path.join(directory, 'chat.db')]
+
+        print(f"{args.count} messages, latency per message in ms")
+        print(f"{'database':<50} {'mean':>8} {'p50':>8} {'p99':>8} {'batched':>8}")
+        for url in urls:
+            try:
+                result = benchmark(url, args.count, args.batch, args.sqlite_synchronous)
+            except Exception as e:
+                print(f"{url:<50} failed: {e}")
+                continue
+            print(f"{url:<50} {result['mean']:>8.3f} {result['p50']:>8.3f} {result['p99']:>8.3f} {result['batched']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import argparse
+import logging
+import threading
+from server.bus import Broker
+
+def main():
+    """
+    Main function of the broker.
+
+    This function parses command line arguments for host and port, and forwards the events of the servers of
+    a cluster started with --bus tcp://host:port until interrupted.
+    """
+    logging.basicConfig(filename='broker.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(threadName)s : %(message)s')
+
+    parser = argparse.ArgumentParser(description='Message broker between the chat servers of a cluster.')
+    parser.add_argument('-a', '--host', type=str, default='127.0.0.1', help='Host address')
+    parser.add_argument('-p', '--port', type=int, default=5800, help='Port number')
+    args = parser.parse_args()
+
+    broker = Broker(args.host, args.port)
+    broker.start()
+    print(f"Broker listening on {args.host}:{broker.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(f"\nBroker is shutting down... {broker.stats()}")
+    finally:
+        broker.close()
+
+
+if __name__ == "__main__":
+    main()
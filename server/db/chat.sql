@@ -59,7 +59,9 @@ CREATE TABLE `messages` (
   `body` text COMMENT 'Contentenu du message',
   PRIMARY KEY (`id`),
   KEY `user` (`user`),
-  KEY `room` (`room`),
+  KEY `room_id` (`room`,`id`),
+  KEY `date_message` (`date_message`),
+  FULLTEXT KEY `body` (`body`),
   CONSTRAINT `messages_ibfk_1` FOREIGN KEY (`user`) REFERENCES `users` (`name`),
   CONSTRAINT `messages_ibfk_2` FOREIGN KEY (`room`) REFERENCES `rooms` (`name`)
 ) ENGINE=InnoDB AUTO_INCREMENT=96 DEFAULT CHARSET=utf8mb3;
@@ -74,6 +76,62 @@ LOCK TABLES `messages` WRITE;
 /*!40000 ALTER TABLE `messages` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `messages_archive`
+--
+
+DROP TABLE IF EXISTS `messages_archive`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `messages_archive` (
+  `id` int NOT NULL,
+  `user` varchar(40) DEFAULT NULL,
+  `room` varchar(60) DEFAULT NULL,
+  `date_message` timestamp NULL DEFAULT NULL,
+  `body` text,
+  PRIMARY KEY (`id`),
+  KEY `room_id` (`room`,`id`),
+  KEY `date_message` (`date_message`),
+  FULLTEXT KEY `body` (`body`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `messages_archive`
+--
+
+LOCK TABLES `messages_archive` WRITE;
+/*!40000 ALTER TABLE `messages_archive` DISABLE KEYS */;
+/*!40000 ALTER TABLE `messages_archive` ENABLE KEYS */;
+UNLOCK TABLES;
+
+--
+-- Table structure for table `pending`
+--
+
+DROP TABLE IF EXISTS `pending`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `pending` (
+  `user` varchar(40) NOT NULL,
+  `room` varchar(60) NOT NULL,
+  `requested_at` timestamp NOT NULL,
+  PRIMARY KEY (`user`,`room`),
+  KEY `room_requested_at` (`room`,`requested_at`),
+  CONSTRAINT `pending_ibfk_1` FOREIGN KEY (`user`) REFERENCES `users` (`name`),
+  CONSTRAINT `pending_ibfk_2` FOREIGN KEY (`room`) REFERENCES `rooms` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `pending`
+--
+
+LOCK TABLES `pending` WRITE;
+/*!40000 ALTER TABLE `pending` DISABLE KEYS */;
+/*!40000 ALTER TABLE `pending` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `rooms`
 --
@@ -108,7 +166,6 @@ DROP TABLE IF EXISTS `users`;
 CREATE TABLE `users` (
   `name` varchar(40) NOT NULL,
   `password` varchar(60) NOT NULL,
-  `pending_rooms` varchar(2000) DEFAULT NULL,
   `state` varchar(8) NOT NULL DEFAULT 'valid',
   `reason` varchar(2000) DEFAULT NULL,
   `timeout` timestamp NULL DEFAULT NULL,
@@ -0,0 +1,88 @@
+-- Schema of the chat database for the embedded SQLite backend, same tables as chat.sql
+
+CREATE TABLE IF NOT EXISTS `rooms` (
+  `name` varchar(60) NOT NULL,
+  `type` varchar(7) NOT NULL DEFAULT 'public',
+  PRIMARY KEY (`name`)
+);
+
+CREATE TABLE IF NOT EXISTS `users` (
+  `name` varchar(40) NOT NULL,
+  `password` varchar(60) NOT NULL,
+  `state` varchar(8) NOT NULL DEFAULT 'valid',
+  `reason` varchar(2000) DEFAULT NULL,
+  `timeout` timestamp NULL DEFAULT NULL,
+  `ip` varchar(39) DEFAULT NULL,
+  `date_creation` timestamp NOT NULL,
+  PRIMARY KEY (`name`)
+);
+
+CREATE TABLE IF NOT EXISTS `belong` (
+  `user` varchar(40) NOT NULL,
+  `room` varchar(60) NOT NULL,
+  `test` tinyint(1) DEFAULT '0',
+  PRIMARY KEY (`user`,`room`),
+  FOREIGN KEY (`user`) REFERENCES `users` (`name`),
+  FOREIGN KEY (`room`) REFERENCES `rooms` (`name`)
+);
+CREATE INDEX IF NOT EXISTS `belong_room` ON `belong` (`room`);
+
+CREATE TABLE IF NOT EXISTS `pending` (
+  `user` varchar(40) NOT NULL,
+  `room` varchar(60) NOT NULL,
+  `requested_at` timestamp NOT NULL,
+  PRIMARY KEY (`user`,`room`),
+  FOREIGN KEY (`user`) REFERENCES `users` (`name`),
+  FOREIGN KEY (`room`) REFERENCES `rooms` (`name`)
+);
+CREATE INDEX IF NOT EXISTS `pending_room_requested_at` ON `pending` (`room`,`requested_at`);
+
+CREATE TABLE IF NOT EXISTS `messages` (
+  `id` integer PRIMARY KEY AUTOINCREMENT,
+  `user` varchar(40) DEFAULT NULL,
+  `room` varchar(60) DEFAULT NULL,
+  `date_message` timestamp NULL DEFAULT NULL,
+  `body` text,
+  FOREIGN KEY (`user`) REFERENCES `users` (`name`),
+  FOREIGN KEY (`room`) REFERENCES `rooms` (`name`)
+);
+CREATE INDEX IF NOT EXISTS `messages_user` ON `messages` (`user`);
+CREATE INDEX IF NOT EXISTS `messages_room_id` ON `messages` (`room`,`id`);
+CREATE INDEX IF NOT EXISTS `messages_date_message` ON `messages` (`date_message`);
+
+CREATE TABLE IF NOT EXISTS `messages_archive` (
+  `id` integer PRIMARY KEY,
+  `user` varchar(40) DEFAULT NULL,
+  `room` varchar(60) DEFAULT NULL,
+  `date_message` timestamp NULL DEFAULT NULL,
+  `body` text
+);
+CREATE INDEX IF NOT EXISTS `messages_archive_room_id` ON `messages_archive` (`room`,`id`);
+CREATE INDEX IF NOT EXISTS `messages_archive_date_message` ON `messages_archive` (`date_message`);
+
+-- Full-text indexes of the messages, kept up to date by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS `messages_fts` USING fts5(`body`, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS `messages_fts_insert` AFTER INSERT ON `messages` BEGIN
+  INSERT INTO `messages_fts` (rowid, `body`) VALUES (new.`id`, new.`body`);
+END;
+CREATE TRIGGER IF NOT EXISTS `messages_fts_delete` AFTER DELETE ON `messages` BEGIN
+  INSERT INTO `messages_fts` (`messages_fts`, rowid, `body`) VALUES ('delete', old.`id`, old.`body`);
+END;
+CREATE TRIGGER IF NOT EXISTS `messages_fts_update` AFTER UPDATE ON `messages` BEGIN
+  INSERT INTO `messages_fts` (`messages_fts`, rowid, `body`) VALUES ('delete', old.`id`, old.`body`);
+  INSERT INTO `messages_fts` (rowid, `body`) VALUES (new.`id`, new.`body`);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS `messages_archive_fts` USING fts5(`body`, content='messages_archive', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS `messages_archive_fts_insert` AFTER INSERT ON `messages_archive` BEGIN
+  INSERT INTO `messages_archive_fts` (rowid, `body`) VALUES (new.`id`, new.`body`);
+END;
+CREATE TRIGGER IF NOT EXISTS `messages_archive_fts_delete` AFTER DELETE ON `messages_archive` BEGIN
+  INSERT INTO `messages_archive_fts` (`messages_archive_fts`, rowid, `body`) VALUES ('delete', old.`id`, old.`body`);
+END;
+CREATE TRIGGER IF NOT EXISTS `messages_archive_fts_update` AFTER UPDATE ON `messages_archive` BEGIN
+  INSERT INTO `messages_archive_fts` (`messages_archive_fts`, rowid, `body`) VALUES ('delete', old.`id`, old.`body`);
+  INSERT INTO `messages_archive_fts` (rowid, `body`) VALUES (new.`id`, new.`body`);
+END;
+
+INSERT OR IGNORE INTO `rooms` VALUES ('Blabla','public'),('Comptabilité','public'),('Général','public'),('Informatique','public'),('Marketing','public');
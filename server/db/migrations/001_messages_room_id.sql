@@ -0,0 +1,3 @@
+-- Index of the history pages of the rooms, for the databases imported before it was added to chat.sql
+USE `chat`;
+ALTER TABLE `messages` ADD KEY `room_id` (`room`,`id`), DROP KEY `room`;
@@ -0,0 +1,3 @@
+-- Index of the messages by date, read by the messages command of the server
+USE `chat`;
+ALTER TABLE `messages` ADD KEY `date_message` (`date_message`);
@@ -0,0 +1,23 @@
+-- Moves the pending room requests from the comma separated users.pending_rooms column to the pending table
+USE `chat`;
+
+CREATE TABLE `pending` (
+  `user` varchar(40) NOT NULL,
+  `room` varchar(60) NOT NULL,
+  `requested_at` timestamp NOT NULL,
+  PRIMARY KEY (`user`,`room`),
+  KEY `room_requested_at` (`room`,`requested_at`),
+  CONSTRAINT `pending_ibfk_1` FOREIGN KEY (`user`) REFERENCES `users` (`name`),
+  CONSTRAINT `pending_ibfk_2` FOREIGN KEY (`room`) REFERENCES `rooms` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- The date of the old requests isn't known, they are dated from the migration
+INSERT IGNORE INTO `pending` (`user`, `room`, `requested_at`)
+SELECT `users`.`name`, `requests`.`room`, NOW()
+FROM `users`,
+     JSON_TABLE(CONCAT('["', REPLACE(`users`.`pending_rooms`, ',', '","'), '"]'),
+                '$[*]' COLUMNS (`room` varchar(60) PATH '$')) AS `requests`
+WHERE `users`.`pending_rooms` IS NOT NULL AND `users`.`pending_rooms` <> ''
+  AND `requests`.`room` IN (SELECT `name` FROM `rooms`);
+
+ALTER TABLE `users` DROP COLUMN `pending_rooms`;
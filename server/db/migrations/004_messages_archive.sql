@@ -0,0 +1,13 @@
+-- Table of the archived messages, moved from messages when they are older than the retention of their room
+USE `chat`;
+
+CREATE TABLE `messages_archive` (
+  `id` int NOT NULL,
+  `user` varchar(40) DEFAULT NULL,
+  `room` varchar(60) DEFAULT NULL,
+  `date_message` timestamp NULL DEFAULT NULL,
+  `body` text,
+  PRIMARY KEY (`id`),
+  KEY `room_id` (`room`,`id`),
+  KEY `date_message` (`date_message`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
@@ -0,0 +1,4 @@
+-- Full-text indexes of the messages, read by the search command of the server
+USE `chat`;
+ALTER TABLE `messages` ADD FULLTEXT KEY `body` (`body`);
+ALTER TABLE `messages_archive` ADD FULLTEXT KEY `body` (`body`);
@@ -1,15 +1,24 @@
 import argparse
+import os
 import sys
+import signal
+import shutil
+import socket
+import tempfile
 import logging
 import threading
 from server.server import Server
+from server.async_server import AsyncServer
+from server.selector_server import SelectorServer
+from server.config import Config
+from server.outbox import POLICIES, SLOW_POLICIES
 from server.admin import admin_console, admin_cmd
 
 def main():
     """
     Main function to start the chat server.
 
-    This function parses command line arguments for host and port, validates them, and starts the server.
+    This function parses command line arguments for host, port and mode, validates them, and starts the server.
 
     :raises KeyboardInterrupt: If the server is interrupted by keyboard input
     :raises Exception: If there is an error starting the server
@@ -21,6 +30,69 @@ def main():
     parser = argparse.ArgumentParser(description='Python chat server.')
     parser.add_argument('-a', '--host', type=str, required=True, help='Host address')
     parser.add_argument('-p', '--port', type=int, required=True, help='Port number')
+    parser.add_argument('-m', '--mode', type=str, choices=['thread', 'async', 'selector'], default='thread',
+                        help='Server mode: a thread per client, a single asyncio event loop or a single selector loop feeding the handler threads')
+    parser.add_argument('-w', '--workers', type=int, default=Config.workers,
+                        help='Number of server processes sharing the port, each with its own clients')
+    parser.add_argument('--bus', type=str, default=Config.bus_url,
+                        help='Broker shared by the servers of a cluster, tcp://host:port (see broker.py)')
+    parser.add_argument('--handler-threads', type=int, default=Config.handler_threads,
+                        help='Number of threads running the message handlers in async and selector modes')
+    parser.add_argument('--outbox-size', type=int, default=Config.outbox_high_water,
+                        help='Maximum number of bytes waiting to be sent to a client')
+    parser.add_argument('--outbox-policy', type=str, choices=POLICIES, default=Config.outbox_policy,
+                        help='What to do when a client can not keep up: disconnect it or drop its oldest messages')
+    parser.add_argument('--slow-timeout', type=float, default=Config.slow_consumer_timeout,
+                        help='Time in seconds a client can leave its messages unread before --slow-policy applies (never if 0)')
+    parser.add_argument('--slow-policy', type=str, choices=SLOW_POLICIES, default=Config.slow_consumer_policy,
+                        help='What to do with a slow client: disconnect it or only send it the responses and notifications')
+    parser.add_argument('--persist-batch', type=int, default=Config.persist_batch_size,
+                        help='Maximum number of messages written to the database in a transaction')
+    parser.add_argument('--persist-interval', type=int, default=Config.persist_interval_ms,
+                        help='Maximum time in milliseconds a message waits before being written to the database')
+    parser.add_argument('--persist-queue', type=int, default=Config.persist_queue_size,
+                        help='Maximum number of messages waiting to be written to the database')
+    parser.add_argument('--auth-workers', type=int, default=Config.auth_workers,
+                        help='Number of processes hashing passwords, the number of cores if 0')
+    parser.add_argument('--auth-queue', type=int, default=Config.auth_max_pending,
+                        help='Maximum number of logins waiting for their password to be checked '
+                             '(at most a quarter of the handler threads in async and selector modes)')
+    parser.add_argument('--user-cache-size', type=int, default=Config.user_cache_size,
+                        help='Maximum number of user profiles kept in memory')
+    parser.add_argument('--user-cache-ttl', type=int, default=Config.user_cache_ttl,
+                        help='Time in seconds a cached user profile stays valid')
+    parser.add_argument('--room-reconcile', type=float, default=Config.room_reconcile_interval,
+                        help='Time in seconds between two reloads of the rooms from the database, to see the rooms created by other servers (never if 0)')
+    parser.add_argument('--history-page', type=int, default=Config.history_page_size,
+                        help='Maximum number of messages sent in a page of the history of a room')
+    parser.add_argument('--rate-limit', type=str, action='append', default=[], metavar='TYPE=RATE/BURST',
+                        help='Messages of a type a user can send per second, and at once, overriding the default (no limit if RATE is 0), can be repeated')
+    parser.add_argument('--ip-rate-limit', type=str, action='append', default=[], metavar='TYPE=RATE/BURST',
+                        help='Same as --rate-limit for the messages of an IP address, signin and signup included')
+    parser.add_argument('--retention-days', type=int, default=Config.retention_days,
+                        help='Number of days the messages stay in the messages table before being archived (forever if 0)')
+    parser.add_argument('--room-retention', type=str, action='append', default=[], metavar='ROOM=DAYS',
+                        help='Number of days of a room, overriding --retention-days, can be repeated')
+    parser.add_argument('--retention-interval', type=float, default=Config.retention_interval,
+                        help='Time in seconds between two archivings of the old messages')
+    parser.add_argument('--retention-batch', type=int, default=Config.retention_batch_size,
+                        help='Maximum number of messages archived in a transaction')
+    parser.add_argument('--database', type=str, default=Config.database_url,
+                        help='Database URL, a MySQL server or a SQLite file (sqlite:///path/to/chat.db)')
+    parser.add_argument('--database-replica', type=str, action='append', default=[],
+                        help='URL of a read-only replica of the database, can be repeated')
+    parser.add_argument('--sqlite-synchronous', type=str, choices=['OFF', 'NORMAL', 'FULL', 'EXTRA'], default=Config.sqlite_synchronous,
+                        help='Synchronous level of a SQLite database, NORMAL may lose the last transactions on power loss but not corrupt the database')
+    parser.add_argument('--db-pool-size', type=int, default=Config.db_pool_size,
+                        help='Number of database connections kept open')
+    parser.add_argument('--db-pool-overflow', type=int, default=Config.db_max_overflow,
+                        help='Number of database connections opened past the pool size when every connection is in use')
+    parser.add_argument('--db-pool-timeout', type=float, default=Config.db_pool_timeout,
+                        help='Maximum time in seconds to wait for a database connection')
+    parser.add_argument('--db-pool-recycle', type=int, default=Config.db_pool_recycle,
+                        help='Age in seconds after which a database connection is replaced (never if -1)')
+    parser.add_argument('--db-pre-ping', action='store_true', default=Config.db_pool_pre_ping,
+                        help='Test the database connections before using them')
 
     args = parser.parse_args()
     host = args.host
@@ -31,9 +103,91 @@ def main():
         logging.error("Port must be an integer between 0 and 65535")
         sys.exit(2)
 
+    ## Parse the retention of the rooms
+    room_retention = {}
+    for retention in args.room_retention:
+        room, _, days = retention.rpartition('=')
+        if not room or not days.isdigit():
+            parser.error(f"Invalid room retention: {retention}, use ROOM=DAYS")
+        room_retention[room] = int(days)
+
+    ## Parse the rate limits, over the default ones
+    rate_limits = dict(Config.rate_limits)
+    ip_rate_limits = dict(Config.ip_rate_limits)
+    for limits, values in ((rate_limits, args.rate_limit), (ip_rate_limits, args.ip_rate_limit)):
+        for value in values:
+            message_type, _, limit = value.partition('=')
+            rate, _, burst = limit.partition('/')
+            try:
+                rate, burst = float(rate), float(burst or rate)
+            except ValueError:
+                message_type = None
+            if not message_type:
+                parser.error(f"Invalid rate limit: {value}, use TYPE=RATE/BURST")
+            if rate > 0:
+                limits[message_type] = (rate, max(burst, 1))
+            else:
+                limits.pop(message_type, None)
+
+    ## Validate the number of workers
+    if args.workers < 1:
+        parser.error("The number of workers must be at least 1")
+    if args.workers > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+        parser.error("Several workers need fork() and SO_REUSEPORT, which this platform doesn't support")
+
+    ## The workers share the cores for the password hashing
+    auth_workers = args.auth_workers
+    if args.workers > 1 and auth_workers == 0:
+        auth_workers = max(1, (os.cpu_count() or 1) // args.workers)
+
+    settings = dict(handler_threads=args.handler_threads,
+                    outbox_high_water=args.outbox_size,
+                    outbox_policy=args.outbox_policy,
+                    slow_consumer_timeout=args.slow_timeout,
+                    slow_consumer_policy=args.slow_policy,
+                    persist_batch_size=args.persist_batch,
+                    persist_interval_ms=args.persist_interval,
+                    persist_queue_size=args.persist_queue,
+                    auth_workers=auth_workers,
+                    auth_max_pending=args.auth_queue,
+                    user_cache_size=args.user_cache_size,
+                    user_cache_ttl=args.user_cache_ttl,
+                    room_reconcile_interval=args.room_reconcile,
+                    history_page_size=args.history_page,
+                    retention_days=args.retention_days,
+                    room_retention=room_retention,
+                    rate_limits=rate_limits,
+                    ip_rate_limits=ip_rate_limits,
+                    retention_interval=args.retention_interval,
+                    retention_batch_size=args.retention_batch,
+                    database_url=args.database,
+                    database_replicas=args.database_replica,
+                    sqlite_synchronous=args.sqlite_synchronous,
+                    db_pool_size=args.db_pool_size,
+                    db_max_overflow=args.db_pool_overflow,
+                    db_pool_timeout=args.db_pool_timeout,
+                    db_pool_recycle=args.db_pool_recycle,
+                    db_pool_pre_ping=args.db_pre_ping,
+                    workers=args.workers,
+                    bus_url=args.bus)
+    server_class = {'thread':Server, 'async':AsyncServer, 'selector':SelectorServer}[args.mode]
+
+    ## Start the other workers, this process is the worker 0 and runs the admin consoles
+    children = []
+    fanout_dir = None
+    if args.workers > 1:
+        fanout_dir = tempfile.mkdtemp(prefix='chat-')
+        for worker_id in range(1, args.workers):
+            pid = os.fork()
+            if pid == 0:
+                run_worker(server_class, host, port, Config(worker_id=worker_id, fanout_dir=fanout_dir, **settings))
+                os._exit(0)
+            children.append(pid)
+    config = Config(worker_id=0, fanout_dir=fanout_dir, **settings)
+
     ## Start the server
     try:
-        server = Server(host, port)
+        server = server_class(host, port, config)
         
         server_thread = threading.Thread(target=server.run)
         console_thread = threading.Thread(target=admin_console, args=(server,))
@@ -61,6 +215,42 @@ def main():
         server_thread.join()
         console_thread.join()
         admin_thread.join()
+        stop_workers(children, fanout_dir)
+
+def run_worker(server_class:type, host:str, port:int, config:Config):
+    """
+    Run a worker process, without admin console, until it is terminated by the first worker.
+
+    :param type server_class: Server, AsyncServer or SelectorServer.
+    :param str host: The host address.
+    :param int port: The port number.
+    :param Config config: The configuration of the worker.
+    """
+    ## Ctrl+C reaches every process of the terminal, the first worker stops the others
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        server = server_class(host, port, config)
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.close())
+        server.run()
+    except Exception as e:
+        logging.error(f"Failed to run worker {config.worker_id}: {e}")
+
+def stop_workers(children:list, fanout_dir:str):
+    """
+    Terminate the other workers and wait for them to end.
+
+    :param list children: The process ids of the workers.
+    :param str fanout_dir: The directory of the sockets of the workers, removed once they ended.
+    """
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in children:
+        os.waitpid(pid, 0)
+    if fanout_dir is not None:
+        shutil.rmtree(fanout_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
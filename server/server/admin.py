@@ -65,6 +65,23 @@ def convert_to_date_minus(time_str:str) -> datetime:
     else:
         raise ValueError("Invalid time unit. Use 's' for seconds, 'm' for minutes, 'h' for hours, 'd' for days, or 'y' for years.")
 
+def print_unanswered(server:'Server', answers:dict):
+    """
+    Tell the admin when some servers didn't answer a query, instead of showing a partial answer as complete.
+
+    :param Server server: The server.
+    :param dict answers: The answer of each server.
+    """
+    if server.bus is None:
+        return
+    peers = server.bus.peers()
+    if peers is None:
+        ## The number of servers is unknown, only an answer from no other server is suspect
+        if len(answers) == 1:
+            print("No other server answered.")
+    elif len(answers) <= peers:
+        print(f"{peers + 1 - len(answers)} server(s) didn't answer.")
+
 ################################################################################################################
 
 def admin_console(server:'Server'):
@@ -84,7 +101,7 @@ def create_completer(server:'Server') -> 'function':
     :return: A function that takes the current text and a state and returns the next matching command.
     :rtype: function
     """
-    base_commands = ["help", "messages", "users", "rooms", "add room", "pending rooms", "accept pending", "kick", "unkick", "ban", "unban", "kill", "shutdown"]
+    base_commands = ["help", "messages", "search", "users", "stats", "slow", "rooms", "add room", "pending rooms", "pending users", "accept pending", "kick", "unkick", "ban", "unban", "kill", "shutdown"]
     user_commands = [f"{command} {user.name}" for command in ["kick", "unkick", "ban", "unban", "pending rooms", "accept pending"] for user in server.clients]
     ip_commands = [f"{command} ip" for command in ["ban", "unban"]]
 
@@ -133,12 +150,16 @@ def admin_cmd(server:'Server'):
             print("""Available commands:
 help - display this help message
 
-messages <time> - display a list of all messages since a time
+messages <time> [room <room>] [user <username>] [limit <number>] - display the messages since a time
+search <words> [room <room>] [user <username>] [since <time>] [page <number>] - search the messages containing words
 users - display a list of all users
+stats - display the metrics of the server
+slow [number] - display the clients the longest behind in reading their messages
 
 rooms - display a list of all rooms
 add room <room1,room2,...> - add a room
 pending rooms <username> - display a list of pending rooms for a user
+pending users <room> - display the users waiting to join a room
 accept pending <username> <room1,room2,...> - accept pending rooms for a user
 
 kick <username> <timeout> <reason> - kick a user
@@ -157,20 +178,79 @@ shutdown - shutdown the server""")
         elif command.startswith("messages"):
             try:
                 date = convert_to_date_minus(command.split(" ")[1])
+                ## Optional filters, given as name value pairs
+                filters = dict(zip(command.split(" ")[2::2], command.split(" ")[3::2]))
+                limit = int(filters['limit']) if 'limit' in filters else None
                 print(f"Messages since {date}:")
-                ## Get messages in the database since the date
-                for message in server.database.fetch_messages_since(date):
+                ## Stream the messages from the database since the date, a chunk at a time
+                for message in server.database.stream_messages_since(date, filters.get('room'), filters.get('user'), limit):
                     ## Convert the date to a string
                     date_str = message[2].strftime("%Y-%m-%d %H:%M:%S")
                     print(message[0] + " in " + message[1] + " at " + date_str + " : " + message[3])
             except IndexError:
                 print("Please specify a date")
+            except ValueError:
+                print("Please specify a valid date and limit")
         
+        elif command.startswith("search "):
+            try:
+                ## The filters are name value pairs, the other words are searched
+                words, filters = [], {}
+                tokens = command.split(" ")[1:]
+                while tokens:
+                    token = tokens.pop(0)
+                    if token in ("room", "user", "since", "page") and tokens:
+                        filters[token] = tokens.pop(0)
+                    else:
+                        words.append(token)
+                since = convert_to_date_minus(filters['since']) if 'since' in filters else None
+                page = int(filters.get('page', 1))
+                page_size = server.config.search_page_size
+                print(f"Messages containing {' '.join(words)}, page {page}:")
+                for message in server.database.search_messages(" ".join(words), filters.get('room'), filters.get('user'), since,
+                                                               page_size, (page - 1) * page_size):
+                    date_str = message[3].strftime("%Y-%m-%d %H:%M:%S")
+                    print(f"[{message[5]:.2f}] " + message[1] + " in " + message[2] + " at " + date_str + " : " + message[4])
+            except ValueError:
+                print("Please specify a valid date and page")
+
         elif command == "users":
+            ## The clients connected to every worker and server
+            answers = server.query('users')
             print("Users:")
-            for user in server.clients:
-                print(user.name + " " + user.ip[0])
+            for node, users in answers.items():
+                for name, ip in users:
+                    print(name + " " + ip + (f" on {node}" if len(answers) > 1 else ""))
+            print_unanswered(server, answers)
         
+        elif command == "stats":
+            answers = server.query('stats')
+            for node, stats in answers.items():
+                print(f"Stats of {node}:" if len(answers) > 1 else "Stats:")
+                for section, metrics in stats.items():
+                    print(f"{section}:")
+                    for name, value in metrics.items():
+                        print(f"  {name}: {value}")
+            print_unanswered(server, answers)
+
+        elif command == "slow" or command.startswith("slow "):
+            try:
+                count = int(command.split(" ")[1]) if " " in command else 10
+                answers = server.query('slow', {'count':count})
+                ## The slowest clients of every worker and server
+                clients = [dict(client, node=node) for node, slow in answers.items() for client in slow]
+                clients.sort(key=lambda client: (client['stalled'], client['size']), reverse=True)
+                print("Slowest clients:")
+                for client in clients[:count]:
+                    last_write = f"{client['last_write']:.1f}s ago" if client['last_write'] is not None else "never"
+                    print(f"{client['name'] or '-'} {client['ip']}" + (f" on {client['node']}" if len(answers) > 1 else "") +
+                          f" : {client['size']} bytes in {client['frames']} frames waiting, "
+                          f"stalled {client['stalled']:.1f}s, last write {last_write}, "
+                          f"{client['dropped']} dropped, {client['skipped']} skipped")
+                print_unanswered(server, answers)
+            except ValueError:
+                print("Please specify a valid number")
+
         elif command == "rooms":    
             print("Rooms:")
             for room in server.rooms:
@@ -187,35 +267,47 @@ shutdown - shutdown the server""")
         elif command.startswith("pending rooms"):
             try:
                 username = command.split(" ")[2]
-                print(f"Pending rooms for {username}:")
-                for client in server.clients:
-                    if client.name == username:
-                        for room in client.pending_rooms:
-                            print(room)
-                        break
+                ## Read from the database, the user may be connected to another worker or server
+                profile = server.database.load_user_profile(username)
+                if profile is None:
+                    print(f"User {username} does not exist.")
+                else:
+                    print(f"Pending rooms for {username}:")
+                    for room in profile['pending_rooms']:
+                        print(room)
             except IndexError:
                 print("Please specify a username")
         
+        elif command.startswith("pending users"):
+            try:
+                room = command.split(" ")[2]
+                print(f"Users waiting to join {room}:")
+                for user, requested_at in server.database.fetch_pending_by_room(room):
+                    print(user + " since " + requested_at.strftime("%Y-%m-%d %H:%M:%S"))
+            except IndexError:
+                print("Please specify a room")
+
         elif command.startswith("accept pending"):
             try:
                 username = command.split(" ")[2]
                 rooms = command.split(" ")[3]
-                if rooms == "all":
-                    for client in server.clients:
-                        if client.name == username:
-                            for room in client.pending_rooms:
-                                # Check if the user is already in the room
-                                if room not in client.rooms:
-                                    client.addroom(server, room) 
-                            break
+                ## Accepted in the database, the server the user is connected to adds the rooms to its client
+                profile = server.database.load_user_profile(username)
+                if profile is None:
+                    print(f"User {username} does not exist.")
                 else:
-                    for room in rooms.split(","):
-                        for client in server.clients:
-                            if client.name == username:
-                                # Check if the user is already in the room
-                                if room not in client.rooms:
-                                    client.addroom(server, room)
-                                break
+                    if rooms == "all":
+                        rooms = profile['pending_rooms']
+                    else:
+                        rooms = rooms.split(",")
+                    for room in rooms:
+                        if not server.room_catalog.exists(room):
+                            print(f"Room {room} does not exist.")
+                        # Check if the user is already in the room
+                        elif room not in profile['rooms']:
+                            if not server.add_member(username, room):
+                                print(f"Room {room} accepted, but the other servers couldn't be told: "
+                                      f"{username} gets it when logging in again.")
             except IndexError:
                 print("Please specify a username and a room")
 
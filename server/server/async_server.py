@@ -0,0 +1,180 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .client import Client
+from .server import Server
+from .message_handler import async_handler
+
+## Import the types for documentation purposes
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .registry import ClientRegistry
+    from .config import Config
+
+class AsyncClient(Client):
+    """
+    A client connected to the asyncio server. The connection is an asyncio stream instead of a socket
+    read by a dedicated thread.
+
+    :ivar asyncio.StreamReader reader: The stream to read from.
+    :ivar asyncio.StreamWriter writer: The stream to write to.
+    :ivar asyncio.AbstractEventLoop loop: The event loop owning the streams.
+    """
+    def __init__(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter, host:str, port:int, clients:'ClientRegistry', server:'AsyncServer'):
+        """
+        Initialize the AsyncClient with its streams.
+
+        :param asyncio.StreamReader reader: The stream to read from.
+        :param asyncio.StreamWriter writer: The stream to write to.
+        :param str host: The host address.
+        :param int port: The port number.
+        :param ClientRegistry clients: The registry of clients.
+        :param AsyncServer server: The server.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        super().__init__(writer.get_extra_info('socket'), writer.get_extra_info('peername'), host, port, clients, server)
+
+    def start(self, clients:'ClientRegistry', server:'AsyncServer'):
+        """
+        Start the writer coroutine of the client. The server awaits the client's handler coroutine itself.
+
+        :param ClientRegistry clients: The registry of clients.
+        :param AsyncServer server: The server.
+        """
+        self._ready = asyncio.Event()
+        self.outbox.on_ready = self._notify_writer
+        self.write_task = self.loop.create_task(self.write())
+
+    ############################################################################################################
+
+    async def receive(self) -> list or None:
+        """
+        Receive data from the client.
+
+        :return: The messages completed by the received data, None if the client closed the connection.
+        :rtype: list or None
+        :raises FrameError: If the client sent a frame bigger than the maximum size.
+        """
+        data = await self.reader.read(65536)
+        if not data:
+            return None
+        return self.decoder.feed(data)
+
+    def _notify_writer(self):
+        """
+        Wake up the writer coroutine. Can be called from any thread.
+        """
+        self.loop.call_soon_threadsafe(self._ready.set)
+
+    async def write(self):
+        """
+        Write the queued frames to the stream until the outbox is closed, then close the stream.
+        """
+        try:
+            while True:
+                frame = self.outbox.pop()
+                if frame is None:
+                    if self.outbox.closed:
+                        break
+                    await self._ready.wait()
+                    self._ready.clear()
+                    continue
+                self.writer.write(frame)
+                await self.writer.drain()
+                self.outbox.written(len(frame))
+        except (ConnectionError, OSError) as e:
+            logging.error(f"Failed to send to client: {e}")
+            self.outbox.close(discard=True)
+        finally:
+            self.writer.close()
+
+    def abort(self):
+        """
+        Close the stream now, without writing the buffered data. Can be called from any thread.
+        """
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+class AsyncServer(Server):
+    """
+    A Server holding every connection on a single asyncio event loop. Blocking work (database, bcrypt)
+    is done in a bounded thread pool, so the number of threads doesn't grow with the number of clients.
+
+    :ivar ThreadPoolExecutor executor: The executor running the message handlers.
+    :ivar asyncio.AbstractEventLoop loop: The event loop of the server.
+    """
+
+    def __init__(self, host:str, port:int, config:'Config'=None):
+        """
+        Initialize the AsyncServer.
+
+        :param str host: The host address.
+        :param int port: The port number.
+        :param Config config: The settings of the server, defaults if None.
+        """
+        super().__init__(host, port, config)
+        self.executor = ThreadPoolExecutor(max_workers=self.config.handler_threads, thread_name_prefix="handler")
+        ## A handler waiting for its password to be checked holds a thread of the pool until bcrypt is done,
+        ## keep most of the threads for the other messages, the logins past it get a server_busy error
+        self.passwords.max_pending = min(self.passwords.max_pending, max(1, self.config.handler_threads // 4))
+        self.loop = None
+        self._stopped = None
+
+    ############################################################################################################
+
+    def run(self):
+        """
+        Run the server until it is closed.
+        """
+        logging.info("Running asyncio server")
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            logging.error(f"Failed to run the server: {e}")
+
+    async def serve(self):
+        """
+        Accept client connections until the server is closed.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+
+        sock = self.create_socket()
+        server = await asyncio.start_server(self.handle_connection, sock=sock)
+
+        await self._stopped.wait()
+
+        ## Close all client connections
+        server.close()
+        self.close_clients()
+        await asyncio.sleep(0.5)
+        await server.wait_closed()
+
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        """
+        Handle a new client connection.
+
+        :param asyncio.StreamReader reader: The stream to read from.
+        :param asyncio.StreamWriter writer: The stream to write to.
+        """
+        try:
+            client = AsyncClient(reader, writer, self.host, self.port, self.clients, self)
+        except Exception as e:
+            logging.error(f"Failed to handle a client: {e}")
+            writer.close()
+            return
+        try:
+            await async_handler(client, self.clients, self)
+        except asyncio.CancelledError:
+            ## The event loop is stopping
+            pass
+
+    def wake(self):
+        """
+        Wake up the event loop so it sees the server is stopping.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
@@ -0,0 +1,131 @@
+import os
+import threading
+import multiprocessing
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor
+
+class ServerBusy(Exception):
+    """
+    Raised when too many password operations are already waiting.
+    """
+
+def hash_password(password:bytes) -> bytes:
+    """
+    Hash a password with a new salt. Run in the worker processes.
+
+    :param bytes password: The password.
+    :return: The hashed password.
+    :rtype: bytes
+    """
+    return bcrypt.hashpw(password, bcrypt.gensalt())
+
+def check_password(password:bytes, hashed_password:bytes) -> bool:
+    """
+    Check a password against its hash. Run in the worker processes.
+
+    :param bytes password: The password.
+    :param bytes hashed_password: The hashed password.
+    :return: True if the password matches.
+    :rtype: bool
+    """
+    return bcrypt.checkpw(password, hashed_password)
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a pool of processes, so authentication uses every core and the handlers
+    of the other messages never wait for the CPU.
+
+    The number of operations waiting or running is bounded, past it the operation is refused
+    at once with ServerBusy instead of queuing behind a reconnect storm.
+
+    :ivar int workers: The number of processes.
+    :ivar int max_pending: The maximum number of operations waiting or running.
+    :ivar int completed: The number of operations done.
+    :ivar int failed: The number of operations which raised an error.
+    :ivar int rejected: The number of operations refused because too many were pending.
+    """
+    def __init__(self, workers:int=0, max_pending:int=64):
+        """
+        Initialize the PasswordHasher. The processes are started on first use.
+
+        :param int workers: The number of processes, the number of cores if 0.
+        :param int max_pending: The maximum number of operations waiting or running.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        ## Spawn the processes, forking a process running threads isn't safe
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+
+    def _run(self, function:'function', *args) -> object:
+        """
+        Run a function in the pool and wait for its result.
+
+        :param function function: The function.
+        :return: The result of the function.
+        :rtype: object
+        :raises ServerBusy: If too many operations are pending.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise ServerBusy("Too many password operations pending")
+            self._pending += 1
+        try:
+            result = self._executor.submit(function, *args).result()
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+                self.failed += 1
+            raise
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+        return result
+
+    def hash(self, password:bytes) -> bytes:
+        """
+        Hash a password with a new salt.
+
+        :param bytes password: The password.
+        :return: The hashed password.
+        :rtype: bytes
+        :raises ServerBusy: If too many operations are pending.
+        """
+        return self._run(hash_password, password)
+
+    def check(self, password:bytes, hashed_password:bytes) -> bool:
+        """
+        Check a password against its hash.
+
+        :param bytes password: The password.
+        :param bytes hashed_password: The hashed password.
+        :return: True if the password matches.
+        :rtype: bool
+        :raises ServerBusy: If too many operations are pending.
+        """
+        return self._run(check_password, password, hashed_password)
+
+    def close(self):
+        """
+        Stop the processes.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the pool.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        return {'workers':self.workers,
+                'pending':self._pending,
+                'completed':self.completed,
+                'failed':self.failed,
+                'rejected':self.rejected}
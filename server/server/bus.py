@@ -0,0 +1,533 @@
+import socket
+import threading
+import json
+import logging
+from abc import ABC, abstractmethod
+from urllib.parse import urlsplit
+from .framing import FrameDecoder, FrameError, encode_frame
+
+class Bus(ABC):
+    """
+    Publish/subscribe channel between the servers of a cluster: the events published on a topic by a server
+    are delivered to the other servers subscribed to the topic.
+
+    The servers subscribe to the topic of each room with connected members, so the messages of a room only
+    reach the servers of its members. The subclasses send the events published with publish() and pass the
+    events of the other servers to receive().
+
+    :ivar function deliver: Called with each event of a subscribed topic published by another server.
+    :ivar int published: The number of events published.
+    :ivar int received: The number of events delivered.
+    :ivar int failed: The number of events which couldn't be sent.
+    :ivar set _topics: The subscribed topics.
+    :ivar threading.Lock _topics_lock: The lock protecting the topics, subscribed by several threads.
+    """
+    def __init__(self, deliver:'function'):
+        """
+        Initialize the Bus with no subscription. The events are exchanged once started by start().
+
+        :param function deliver: Called with each event of a subscribed topic, in the thread receiving it.
+        """
+        self.deliver = deliver
+
+        self.published = 0
+        self.received = 0
+        self.failed = 0
+
+        self._topics = set()
+        self._topics_lock = threading.Lock()
+
+    def start(self):
+        """
+        Start exchanging events with the other servers.
+        """
+        pass
+
+    def subscribe(self, topic:str):
+        """
+        Receive the events of a topic.
+
+        :param str topic: The topic.
+        """
+        with self._topics_lock:
+            self._topics.add(topic)
+
+    def unsubscribe(self, topic:str):
+        """
+        Stop receiving the events of a topic.
+
+        :param str topic: The topic.
+        """
+        with self._topics_lock:
+            self._topics.discard(topic)
+
+    def subscribed(self, topic:str) -> bool:
+        """
+        Check if the events of a topic are received.
+
+        :param str topic: The topic.
+        :return: True if the topic is subscribed.
+        :rtype: bool
+        """
+        with self._topics_lock:
+            return topic in self._topics
+
+    @abstractmethod
+    def publish(self, topic:str, event:dict) -> bool:
+        """
+        Send an event to the other servers subscribed to a topic.
+
+        :param str topic: The topic.
+        :param dict event: The event, serialized to JSON.
+        :return: True if the event was sent, False if some servers can't get it.
+        :rtype: bool
+        """
+
+    def receive(self, topic:str, event:dict):
+        """
+        Deliver an event published by another server, if its topic is subscribed.
+
+        :param str topic: The topic.
+        :param dict event: The event.
+        """
+        if not self.subscribed(topic):
+            return
+        self.received += 1
+        try:
+            self.deliver(event)
+        except Exception as e:
+            logging.error(f"Failed to deliver an event of {topic}: {e}")
+
+    def close(self):
+        """
+        Stop exchanging events.
+        """
+        pass
+
+    def peers(self) -> int or None:
+        """
+        Get the number of other servers reached by the bus.
+
+        :return: The number of servers, None if unknown.
+        :rtype: int or None
+        """
+        return None
+
+    ############################################################################################################
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the bus.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        return {'topics':len(self._topics),
+                'published':self.published,
+                'received':self.received,
+                'failed':self.failed}
+
+class LoopbackBus(Bus):
+    """
+    Bus between the servers of a single process, the events are delivered by the thread publishing them.
+    Used to run a cluster in a process, for tests.
+
+    :ivar str hub: The name of the group of buses exchanging events.
+    """
+    _hubs = {}
+    _hubs_lock = threading.Lock()
+
+    def __init__(self, deliver:'function', hub:str='default'):
+        """
+        Initialize the LoopbackBus.
+
+        :param function deliver: Called with each event of a subscribed topic.
+        :param str hub: The name of the group of buses exchanging events.
+        """
+        super().__init__(deliver)
+        self.hub = hub
+
+    def start(self):
+        """
+        Join the buses of the hub.
+        """
+        with LoopbackBus._hubs_lock:
+            LoopbackBus._hubs.setdefault(self.hub, []).append(self)
+
+    def publish(self, topic:str, event:dict) -> bool:
+        """
+        Deliver an event to the other buses of the hub subscribed to a topic.
+
+        :param str topic: The topic.
+        :param dict event: The event.
+        :return: True, the buses of the hub always get the event.
+        :rtype: bool
+        """
+        self.published += 1
+        ## Serialized like on a network, so no server shares the objects of another
+        data = json.dumps(event)
+        with LoopbackBus._hubs_lock:
+            buses = [bus for bus in LoopbackBus._hubs.get(self.hub, ()) if bus is not self]
+        for bus in buses:
+            bus.receive(topic, json.loads(data))
+        return True
+
+    def peers(self) -> int:
+        """
+        Get the number of other buses of the hub.
+
+        :return: The number of buses.
+        :rtype: int
+        """
+        with LoopbackBus._hubs_lock:
+            return len([bus for bus in LoopbackBus._hubs.get(self.hub, ()) if bus is not self])
+
+    def close(self):
+        """
+        Leave the buses of the hub.
+        """
+        with LoopbackBus._hubs_lock:
+            buses = LoopbackBus._hubs.get(self.hub, [])
+            if self in buses:
+                buses.remove(self)
+
+class TcpBus(Bus):
+    """
+    Bus through a Broker: the subscriptions and the events are sent to the broker on a TCP connection, in
+    frames of JSON objects like the messages of the clients, and the broker sends back the events of the
+    subscribed topics.
+
+    The connection is opened again on the next event when it is lost, and the topics subscribed again. The
+    events published while the broker can't be reached are lost.
+
+    :ivar str host: The address of the broker.
+    :ivar int port: The port of the broker.
+    """
+    def __init__(self, deliver:'function', host:str, port:int):
+        """
+        Initialize the TcpBus. It connects once started by start().
+
+        :param function deliver: Called with each event of a subscribed topic, in the reader thread.
+        :param str host: The address of the broker.
+        :param int port: The port of the broker.
+        """
+        super().__init__(deliver)
+        self.host = host
+        self.port = port
+
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        """
+        Connect to the broker.
+
+        :raises OSError: If the broker can't be reached.
+        """
+        with self._send_lock:
+            self._connect()
+
+    def _connect(self):
+        """
+        Open the connection to the broker, subscribe the topics and start reading the events.
+        Called with the send lock held.
+        """
+        sock = socket.create_connection((self.host, self.port))
+        with self._topics_lock:
+            topics = list(self._topics)
+        for topic in topics:
+            sock.sendall(encode_frame(json.dumps({'op':'subscribe', 'topic':topic})))
+        self._sock = sock
+        threading.Thread(target=self.read, args=(sock,), name="bus-read", daemon=True).start()
+
+    def _send(self, message:dict, connect:bool=True) -> bool:
+        """
+        Send a message to the broker, connecting again if the connection was lost.
+
+        :param dict message: The message.
+        :param bool connect: Whether to connect if not connected, or drop the message.
+        :return: True if the message was sent.
+        :rtype: bool
+        """
+        frame = encode_frame(json.dumps(message))
+        with self._send_lock:
+            if self._closed or (self._sock is None and not connect):
+                return False
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._sock.sendall(frame)
+                return True
+            except OSError as e:
+                logging.warning(f"Failed to send to the broker: {e}")
+                if self._sock is not None:
+                    self._sock.close()
+                    self._sock = None
+                return False
+
+    def subscribe(self, topic:str):
+        """
+        Receive the events of a topic.
+
+        :param str topic: The topic.
+        """
+        super().subscribe(topic)
+        ## Every topic is subscribed again on connection
+        self._send({'op':'subscribe', 'topic':topic}, connect=False)
+
+    def unsubscribe(self, topic:str):
+        """
+        Stop receiving the events of a topic.
+
+        :param str topic: The topic.
+        """
+        super().unsubscribe(topic)
+        self._send({'op':'unsubscribe', 'topic':topic}, connect=False)
+
+    def publish(self, topic:str, event:dict) -> bool:
+        """
+        Send an event to the broker.
+
+        :param str topic: The topic.
+        :param dict event: The event, serialized to JSON.
+        :return: True if the event was sent to the broker.
+        :rtype: bool
+        """
+        self.published += 1
+        if not self._send({'op':'publish', 'topic':topic, 'event':event}):
+            self.failed += 1
+            return False
+        return True
+
+    def read(self, sock:socket.socket):
+        """
+        Read the events sent by the broker and deliver them.
+
+        :param socket.socket sock: The connection to the broker.
+        """
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    message = json.loads(frame)
+                    self.receive(message['topic'], message['event'])
+        except (OSError, FrameError, ValueError) as e:
+            if not self._closed:
+                logging.error(f"Lost the connection to the broker: {e}")
+        with self._send_lock:
+            ## Connect again on the next message
+            if self._sock is sock:
+                self._sock = None
+        sock.close()
+
+    def close(self):
+        """
+        Close the connection to the broker.
+        """
+        with self._send_lock:
+            self._closed = True
+            if self._sock is not None:
+                try:
+                    self._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self._sock = None
+
+    ############################################################################################################
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the bus.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        stats = super().stats()
+        stats['connected'] = self._sock is not None
+        return stats
+
+def create_bus(url:str, deliver:'function') -> Bus:
+    """
+    Create the bus of a URL.
+
+    :param str url: 'loopback', 'loopback://hub' or 'tcp://host:port' for a Broker.
+    :param function deliver: Called with each event of a subscribed topic.
+    :return: The bus, not started.
+    :rtype: Bus
+    :raises ValueError: If the URL is not supported.
+    """
+    if url == 'loopback':
+        return LoopbackBus(deliver)
+    parts = urlsplit(url)
+    if parts.scheme == 'loopback':
+        return LoopbackBus(deliver, parts.netloc or 'default')
+    if parts.scheme == 'tcp' and parts.hostname and parts.port:
+        return TcpBus(deliver, parts.hostname, parts.port)
+    raise ValueError(f"Unsupported bus URL: {url}")
+
+class Broker:
+    """
+    Message broker of the TcpBus, a stand-in for a real broker in the tests and the small deployments:
+    each event published is sent to the other connections subscribed to its topic.
+
+    :ivar str host: The address the broker listens on.
+    :ivar int port: The port the broker listens on, chosen by the system if 0 until started.
+    :ivar int forwarded: The number of events sent to a subscriber.
+    :ivar int failed: The number of events which couldn't be sent to a subscriber.
+    """
+    def __init__(self, host:str, port:int):
+        """
+        Initialize the Broker. It listens once started by start().
+
+        :param str host: The address to listen on.
+        :param int port: The port to listen on, 0 for any.
+        """
+        self.host = host
+        self.port = port
+
+        self.forwarded = 0
+        self.failed = 0
+
+        self._subscribers = {}
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._sock = None
+
+    def start(self):
+        """
+        Listen for the connections of the servers.
+        """
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self.port = self._sock.getsockname()[1]
+        self._sock.listen(socket.SOMAXCONN)
+        threading.Thread(target=self.accept, name="broker-accept", daemon=True).start()
+
+    def accept(self):
+        """
+        Accept the connections of the servers, each read by a thread of its own.
+        """
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            with self._lock:
+                self._connections[conn] = threading.Lock()
+            threading.Thread(target=self.read, args=(conn,), name="broker-read", daemon=True).start()
+
+    def read(self, conn:socket.socket):
+        """
+        Read the subscriptions and the events of a server.
+
+        :param socket.socket conn: The connection of the server.
+        """
+        decoder = FrameDecoder()
+        try:
+            while not self._closed:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    message = json.loads(frame)
+                    if message['op'] == 'subscribe':
+                        with self._lock:
+                            self._subscribers.setdefault(message['topic'], set()).add(conn)
+                    elif message['op'] == 'unsubscribe':
+                        self.unsubscribe(conn, [message['topic']])
+                    elif message['op'] == 'publish':
+                        self.forward(conn, message['topic'], message['event'])
+        except (OSError, FrameError, ValueError, KeyError) as e:
+            if not self._closed:
+                logging.error(f"Lost the connection of a server: {e}")
+        finally:
+            self.drop(conn)
+
+    def forward(self, sender:socket.socket, topic:str, event:dict):
+        """
+        Send an event to the connections subscribed to its topic, except the one of its sender.
+
+        :param socket.socket sender: The connection of the server publishing the event.
+        :param str topic: The topic.
+        :param dict event: The event.
+        """
+        frame = encode_frame(json.dumps({'topic':topic, 'event':event}))
+        with self._lock:
+            targets = [(conn, self._connections.get(conn)) for conn in self._subscribers.get(topic, ()) if conn is not sender]
+        for conn, lock in targets:
+            if lock is None:
+                continue
+            try:
+                with lock:
+                    conn.sendall(frame)
+                self.forwarded += 1
+            except OSError as e:
+                logging.warning(f"Failed to send an event to a server: {e}")
+                self.failed += 1
+
+    def unsubscribe(self, conn:socket.socket, topics:list):
+        """
+        Remove a connection from the subscribers of topics.
+
+        :param socket.socket conn: The connection.
+        :param list topics: The topics.
+        """
+        with self._lock:
+            for topic in topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(conn)
+                    ## Forget the topics without subscriber
+                    if not subscribers:
+                        del self._subscribers[topic]
+
+    def drop(self, conn:socket.socket):
+        """
+        Forget a closed connection and its subscriptions.
+
+        :param socket.socket conn: The connection.
+        """
+        with self._lock:
+            topics = [topic for topic, subscribers in self._subscribers.items() if conn in subscribers]
+            self._connections.pop(conn, None)
+        self.unsubscribe(conn, topics)
+        conn.close()
+
+    def close(self):
+        """
+        Stop listening and close the connections of the servers.
+        """
+        self._closed = True
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    ############################################################################################################
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the broker.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        return {'connections':len(self._connections),
+                'topics':len(self._subscribers),
+                'forwarded':self.forwarded,
+                'failed':self.failed}
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    A thread-safe cache keeping the most recently used entries, each entry expiring after a time to live.
+
+    :ivar int max_size: The maximum number of entries, the least recently used one is evicted past it.
+    :ivar float ttl: The time in seconds an entry stays valid.
+    :ivar int hits: The number of lookups found in the cache.
+    :ivar int misses: The number of lookups not found or expired.
+    :ivar int evictions: The number of entries evicted to make room.
+    :ivar int generation: The number of invalidations, a value loaded before one of them may be stale.
+    """
+    def __init__(self, max_size:int=10000, ttl:float=300):
+        """
+        Initialize the LRUCache.
+
+        :param int max_size: The maximum number of entries.
+        :param float ttl: The time in seconds an entry stays valid.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key:object) -> object or None:
+        """
+        Get an entry.
+
+        :param object key: The key.
+        :return: The value, None if the key isn't cached or expired.
+        :rtype: object or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key:object, value:object, generation:int=None):
+        """
+        Add or replace an entry.
+
+        :param object key: The key.
+        :param object value: The value.
+        :param int generation: The generation read before the value was loaded, the value isn't cached if an
+                               entry was invalidated since, None to always cache it.
+        :return: False if the value wasn't cached.
+        :rtype: bool
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key:object):
+        """
+        Remove an entry.
+
+        :param object key: The key.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the cache.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        return {'size':len(self._entries),
+                'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions}
@@ -1,25 +1,30 @@
 import threading
 import logging
+import socket
 import json
 from .message_handler import handler
+from .framing import FrameDecoder, encode_frame
+from .outbox import Outbox, DISCONNECT
 
 ## Import the types for documentation purposes
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .server import Server
-    import socket
+    from .registry import ClientRegistry
 
 class Client:
     """
     The Client class represents a client connected to the server.
 
+    :ivar Server server: The server.
     :ivar socket.socket conn: The client's socket connection.
     :ivar str address: The client's address.
-    :ivar str name: The client's name.
+    :ivar str _name: The client's name.
     :ivar bool state: The client's state.
     :ivar list _rooms: The rooms the client is in.
+    :ivar Outbox outbox: The frames waiting to be sent to the client.
     """
-    def __init__(self, conn:'socket.socket', address:str, host:str, port:int, clients:list, server:'Server'):
+    def __init__(self, conn:'socket.socket', address:str, host:str, port:int, clients:'ClientRegistry', server:'Server'):
         """
         Initialize the Client with connection, address, host, port, clients list, and server.
 
@@ -27,16 +32,19 @@ class Client:
         :param str address: The client's IP address.
         :param str host: The host address.
         :param int port: The port number.
-        :param list clients: The list of clients.
+        :param ClientRegistry clients: The registry of clients.
         :param 'Server' server: The server.
         """
         logging.info("Initializing client")
+        self.server = server
         self.conn = conn
         self.ip = address
-        self.name = ""
+        self._name = ""
         self.state = None
         self.pending_rooms = []
         self._rooms = []
+        self.decoder = FrameDecoder()
+        self.outbox = Outbox(server.config.outbox_high_water, server.config.outbox_policy)
         
         ## See if the client is already connected correctly
         self.login = False
@@ -45,11 +53,40 @@ class Client:
         clients.append(self)
 
         ## Start handling client messages
+        self.start(clients, server)
+
+    def start(self, clients:'ClientRegistry', server:'Server'):
+        """
+        Start handling the client's messages in a dedicated thread, and writing to the client in another one.
+
+        :param ClientRegistry clients: The registry of clients.
+        :param Server server: The server.
+        """
         threading.Thread(target=handler, args=(self, clients, server)).start()
-        
+        threading.Thread(target=self.write).start()
 
     ############################################################################################################
 
+    @property
+    def name(self) -> str:
+        """
+        Get the client's name.
+
+        :return: The client's name.
+        :rtype: str
+        """
+        return self._name
+    @name.setter
+    def name(self, name:str):
+        """
+        Set the client's name and update the registry of the server.
+
+        :param str name: The client's name.
+        """
+        old_name = self._name
+        self._name = name
+        self.server.clients.rename(self, old_name, name)
+
     @property
     def rooms(self) -> list:
         """
@@ -71,18 +108,26 @@ class Client:
             rooms = [rooms]
         if not isinstance(rooms, list):
             raise TypeError("Rooms must be a list or a string")
+
+        ## Keep the room index of the server up to date
+        self.server.room_members.leave_all(self, self._rooms)
         self._rooms = rooms
+        self.server.room_members.join_all(self, rooms)
 
     ############################################################################################################
 
-    def receive(self) -> str:
+    def receive(self) -> list or None:
         """
         Receive data from the client.
 
-        :return: The received data.
-        :rtype: str
+        :return: The messages completed by the received data, None if the client closed the connection.
+        :rtype: list or None
+        :raises FrameError: If the client sent a frame bigger than the maximum size.
         """
-        return self.conn.recv(1024).decode()
+        data = self.conn.recv(65536)
+        if not data:
+            return None
+        return self.decoder.feed(data)
 
     def send(self, data:str):
         """
@@ -90,37 +135,113 @@ class Client:
 
         :param str data: The data to send.
         """
-        self.conn.send(data.encode())
+        self.send_frame(encode_frame(data))
 
-    def close(self, clients:list):
+    def send_frame(self, frame:bytes, critical:bool=True):
         """
-        Close the client's connection.
+        Queue a frame to be sent to the client by its writer. Doesn't wait for the client to receive it.
+        If the client's outbox is full with the 'disconnect' policy, the client is disconnected.
 
-        :param list clients: The list of clients.
+        A client whose writer hasn't written anything for longer than the slow consumer timeout is disconnected,
+        or with the 'drop_noncritical' policy only gets the critical frames until it catches up.
+
+        :param bytes frame: The frame.
+        :param bool critical: False for the messages of the rooms, which a slow client can miss.
+        """
+        timeout = self.server.config.slow_consumer_timeout
+        if timeout > 0 and self.outbox.stalled() > timeout:
+            if self.server.config.slow_consumer_policy == DISCONNECT:
+                if not self.outbox.closed:
+                    logging.warning(f"Client {self.name} {self.ip[0]} is too slow, disconnecting")
+                    self.server.count_slow_disconnect()
+                    self.drop()
+                return
+            if not critical:
+                self.outbox.skip()
+                return
+
+        if not self.outbox.put(frame) and not self.outbox.closed:
+            logging.warning(f"Outbox of client {self.name} {self.ip[0]} is full, disconnecting")
+            self.drop()
+
+    def write(self):
+        """
+        Write the queued frames to the socket until the outbox is closed, then close the socket.
+        """
+        while True:
+            frame = self.outbox.get()
+            if frame is None:
+                break
+            try:
+                self.conn.sendall(frame)
+                self.outbox.written(len(frame))
+            except OSError as e:
+                ## An aborted connection is expected to fail
+                if not self.outbox.closed:
+                    logging.error(f"Failed to send to client: {e}")
+                self.outbox.close(discard=True)
+                break
+        self.abort()
+
+    def close(self, clients:'ClientRegistry', flush:bool=True):
+        """
+        Close the client's connection. The connection is closed by the writer once the queued frames are sent.
+
+        :param ClientRegistry clients: The registry of clients.
+        :param bool flush: Whether to send the queued frames before closing, or drop them and close now.
+        :raises ValueError: If the client is already closed.
         """
         logging.info("Closing client")
-        
-        self.conn.close()
+
+        self.outbox.close(discard=not flush)
+        if not flush:
+            self.abort()
         clients.remove(self)
+        self.server.room_members.leave_all(self, self.rooms)
+
+    def drop(self):
+        """
+        Close the client's connection without sending the queued frames, for a client which can't keep up.
+        """
+        try:
+            self.close(self.server.clients, flush=False)
+        except ValueError:
+            ## Already closed
+            pass
+
+    def abort(self):
+        """
+        Shut the socket down, waking up the threads blocked on it, and close it.
+        """
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
         
     ############################################################################################################
 
     def addroom(self, server:'Server', room:str):
         """
-        Add a room to the client's rooms list from the pending list.
+        Add the client's user to a room, from the pending list if it asked to join it.
 
         :param Server server: The server.
         :param str room: The room to add.
         """
+        server.add_member(self.name, room)
+
+    def join_room(self, room:str):
+        """
+        Add a room the client's user was added to in the database to the client's rooms list, and tell the client.
+
+        :param str room: The room.
+        """
         if room in self.pending_rooms:
             self.pending_rooms.remove(room)
-            server.database.execute_sql_query("UPDATE users SET pending_rooms = :pending_rooms WHERE name = :name",
-                                              {'pending_rooms':','.join(self.pending_rooms),
-                                               'name':self.name})
+        if room in self.rooms:
+            return
         self.rooms.append(room)
-        server.database.execute_sql_query("INSERT INTO belong (user, room) VALUES (:user, :room)",
-                                          {'user':self.name,
-                                           'room':room})
+        self.server.room_members.join(self, room)
         
         self.send(json.dumps({'type':'pending_room',
                               'status':'ok',
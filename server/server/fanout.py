@@ -0,0 +1,163 @@
+import os
+import socket
+import threading
+import json
+import logging
+from .framing import FrameDecoder, FrameError, encode_frame
+from .bus import Bus
+
+class Fanout(Bus):
+    """
+    Bus between the worker processes of a server sharing a port, without broker: the events published by
+    a worker are sent to every other worker, which only delivers the ones of its subscribed topics.
+
+    Each worker listens on a Unix socket of a directory shared by the workers. The events are JSON
+    objects sent in frames, like the messages of the clients, on a connection opened to each other
+    worker on the first event. An event which can't be sent to a worker is lost for that worker.
+
+    :ivar str directory: The directory of the sockets of the workers.
+    :ivar int worker: The number of this worker.
+    :ivar int workers: The number of workers.
+    """
+    def __init__(self, directory:str, worker:int, workers:int, deliver:'function'):
+        """
+        Initialize the Fanout. It listens once started by start().
+
+        :param str directory: The directory of the sockets of the workers.
+        :param int worker: The number of this worker, from 0.
+        :param int workers: The number of workers.
+        :param function deliver: Called with each event received from another worker, in its reader thread.
+        """
+        super().__init__(deliver)
+        self.directory = directory
+        self.worker = worker
+        self.workers = workers
+
+        self._peers = {}
+        self._locks = {peer: threading.Lock() for peer in range(workers) if peer != worker}
+        self._closed = False
+        self._sock = None
+
+    def path(self, worker:int) -> str:
+        """
+        Get the path of the socket of a worker.
+
+        :param int worker: The number of the worker.
+        :return: The path.
+        :rtype: str
+        """
+        return os.path.join(self.directory, f"worker-{worker}.sock")
+
+    def start(self):
+        """
+        Listen for the events of the other workers.
+        """
+        path = self.path(self.worker)
+        if os.path.exists(path):
+            os.remove(path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        self._sock.listen(self.workers)
+        threading.Thread(target=self.accept, name="fanout-accept", daemon=True).start()
+
+    def accept(self):
+        """
+        Accept the connections of the other workers, each read by a thread of its own.
+        """
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.read, args=(conn,), name="fanout-read", daemon=True).start()
+
+    def read(self, conn:socket.socket):
+        """
+        Read the events sent by another worker and deliver them.
+
+        :param socket.socket conn: The connection of the worker.
+        """
+        decoder = FrameDecoder()
+        try:
+            while not self._closed:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    message = json.loads(frame)
+                    self.receive(message['topic'], message['event'])
+        except (OSError, FrameError, ValueError) as e:
+            if not self._closed:
+                logging.error(f"Lost the connection of a worker: {e}")
+        finally:
+            conn.close()
+
+    def publish(self, topic:str, event:dict) -> bool:
+        """
+        Send an event to every other worker.
+
+        :param str topic: The topic.
+        :param dict event: The event, serialized to JSON.
+        :return: True if every other worker got the event.
+        :rtype: bool
+        """
+        frame = encode_frame(json.dumps({'topic':topic, 'event':event}))
+        self.published += 1
+        sent = True
+        for peer, lock in self._locks.items():
+            with lock:
+                try:
+                    conn = self._peers.get(peer)
+                    if conn is None:
+                        conn = self._peers[peer] = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        conn.connect(self.path(peer))
+                    conn.sendall(frame)
+                except OSError as e:
+                    ## Reconnect on the next event, the worker may not be started yet or restarted
+                    self._peers.pop(peer).close()
+                    self.failed += 1
+                    sent = False
+                    logging.warning(f"Failed to send an event to worker {peer}: {e}")
+        return sent
+
+    def peers(self) -> int:
+        """
+        Get the number of other workers.
+
+        :return: The number of workers.
+        :rtype: int
+        """
+        return self.workers - 1
+
+    def close(self):
+        """
+        Stop listening and close the connections to the other workers.
+        """
+        self._closed = True
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+            if os.path.exists(self.path(self.worker)):
+                os.remove(self.path(self.worker))
+        for peer, lock in self._locks.items():
+            with lock:
+                conn = self._peers.pop(peer, None)
+                if conn is not None:
+                    conn.close()
+
+    ############################################################################################################
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the channel.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        stats = super().stats()
+        stats['worker'] = self.worker
+        stats['workers'] = self.workers
+        return stats
@@ -1,6 +1,8 @@
+import asyncio
 import logging
 import json
 from .types import *
+from .framing import FrameError
 # attention à votre nommage !
 
 ## Import the types for documentation purposes
@@ -8,25 +10,33 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .client import Client
     from .server import Server
+    from .registry import ClientRegistry
+    from .async_server import AsyncClient, AsyncServer
 
-def handler(client:'Client', clients:list, server:'Server'):
+def handler(client:'Client', clients:'ClientRegistry', server:'Server'):
     """
     Handle client messages.
 
     :param Client client: The client.
-    :param list clients: The list of clients.
+    :param ClientRegistry clients: The registry of clients.
     :param Server server: The server.
     """
-    while not server.stop_clients:
+    ## Stop once the client is closed, by a disconnect message or by the server
+    while not server.stop_clients and client in clients:
         try:
-            data = client.receive()
-            ## Check if data is not empty, prevents errors when client closes
-            if data:
+            messages = client.receive()
+            ## Check if data is not empty, the client closed the connection
+            if messages is None:
+                break
+            for data in messages:
                 try:
                     message = json.loads(data)
                     handle_message(message, client, clients, server)
                 except json.JSONDecodeError:
                     logging.error("Failed to decode JSON")
+        except(FrameError, UnicodeDecodeError) as e:
+            logging.error(f"Invalid frame: {e}")
+            break
         except(ConnectionResetError):
             logging.error("Connection reset")
             break
@@ -37,13 +47,63 @@ def handler(client:'Client', clients:list, server:'Server'):
             logging.error(f"Unexpected error: {e}")
             break
 
-def handle_message(message:dict, client:'Client', clients:list, server:'Server'):
+    ## Forget the client if the connection dropped without a disconnect message
+    if client in clients:
+        try:
+            client.close(clients)
+        except ValueError:
+            ## Closed by another thread in the meantime
+            pass
+
+async def async_handler(client:'AsyncClient', clients:'ClientRegistry', server:'AsyncServer'):
+    """
+    Handle client messages as a coroutine.
+
+    The socket is read on the event loop, the blocking part of the dispatch (database and bcrypt)
+    runs in the server's executor. Messages of a same client are handled in order.
+
+    :param AsyncClient client: The client.
+    :param ClientRegistry clients: The registry of clients.
+    :param AsyncServer server: The server.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while not server.stop_clients:
+            messages = await client.receive()
+            ## None means the client closed the connection
+            if messages is None:
+                break
+            for data in messages:
+                try:
+                    message = json.loads(data)
+                except json.JSONDecodeError:
+                    logging.error("Failed to decode JSON")
+                    continue
+                await loop.run_in_executor(server.executor, handle_message, message, client, clients, server)
+    except(FrameError, UnicodeDecodeError) as e:
+        logging.error(f"Invalid frame: {e}")
+    except(ConnectionResetError):
+        logging.error("Connection reset")
+    except(BrokenPipeError):
+        logging.error("Connection broken")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
+    finally:
+        ## Forget the client if the connection dropped without a disconnect message
+        if client in clients:
+            try:
+                client.close(clients)
+            except ValueError:
+                ## Closed by another thread in the meantime
+                pass
+
+def handle_message(message:dict, client:'Client', clients:'ClientRegistry', server:'Server'):
     """
     Handle a specific type of message.
 
     :param dict message: The message.
     :param Client client: The client.
-    :param list clients: The list of clients.
+    :param ClientRegistry clients: The registry of clients.
     :param Server server: The server.
     """
     message_handlers = {'signup':handle_signup_message,
@@ -51,11 +111,18 @@ def handle_message(message:dict, client:'Client', clients:list, server:'Server')
                         'disconnect':handle_disconnect_message,
                         'pending_room':handle_pending_room_message,
                         'public':handle_public_message,
-                        'private':handle_private_message}
+                        'private':handle_private_message,
+                        'history':handle_history_message}
 
     ## Call the corresponding handler
     handler_message = message_handlers.get(message['type'])
     if handler_message:
+        ## Refuse the messages of a client sending too fast, before any database work
+        if not server.rate_limiter.allow(message['type'], client.name if client.login else None, client.ip[0]):
+            client.send(json.dumps({'type':message['type'],
+                                    'status':'error',
+                                    'reason':'rate_limited'}))
+            return
         handler_message(message, client, clients, server)
     else:
         logging.error(f"Unknown message type: {message['type']}")
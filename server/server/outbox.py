@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import deque
+
+## Policies applied when an outbox is full
+DISCONNECT = 'disconnect'
+DROP_OLDEST = 'drop_oldest'
+POLICIES = (DISCONNECT, DROP_OLDEST)
+
+## Policies applied to a client whose outbox hasn't been written for too long
+DROP_NONCRITICAL = 'drop_noncritical'
+SLOW_POLICIES = (DISCONNECT, DROP_NONCRITICAL)
+
+class Outbox:
+    """
+    Bounded queue of the frames waiting to be written to a client by its writer.
+
+    The size of the queue is counted in bytes. When a frame would get it over the high-water mark,
+    the oldest frames are dropped ('drop_oldest') or the frame is refused so the client can be
+    disconnected ('disconnect').
+
+    :ivar int high_water: The maximum number of bytes in the queue.
+    :ivar str policy: The policy applied when the queue is full.
+    :ivar int size: The number of bytes queued or being written, until the writer wrote them.
+    :ivar int dropped: The number of frames dropped because the queue was full.
+    :ivar int skipped: The number of frames not queued because the client was too slow.
+    :ivar bool closed: Whether the queue accepts no more frames.
+    :ivar float last_write: The time the writer last wrote to the client, from time.monotonic(), None if never.
+    :ivar float waiting_since: The time the queue has been waiting for the writer, from time.monotonic(), None if written.
+    """
+    def __init__(self, high_water:int, policy:str=DISCONNECT, on_ready:'function'=None):
+        """
+        Initialize the Outbox.
+
+        :param int high_water: The maximum number of bytes in the queue.
+        :param str policy: The policy applied when the queue is full.
+        :param function on_ready: Called without the lock when a frame is queued or the queue is closed,
+                                  for writers which can't wait on the condition.
+        :raises ValueError: If the policy is unknown.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbox policy: {policy}")
+        self.high_water = high_water
+        self.policy = policy
+        self.on_ready = on_ready
+        self.size = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.closed = False
+        self.last_write = None
+        self.waiting_since = None
+        self._frames = deque()
+        self._condition = threading.Condition()
+
+    def put(self, frame:bytes) -> bool:
+        """
+        Queue a frame.
+
+        :param bytes frame: The frame, any bytes-like object.
+        :return: False if the frame was refused, because the queue is closed or full with the 'disconnect' policy.
+        :rtype: bool
+        """
+        with self._condition:
+            if self.closed:
+                return False
+            if self.size + len(frame) > self.high_water and self._frames:
+                if self.policy == DISCONNECT:
+                    self.dropped += 1
+                    return False
+                while self._frames and self.size + len(frame) > self.high_water:
+                    self.size -= len(self._frames.popleft())
+                    self.dropped += 1
+            self._frames.append(frame)
+            self.size += len(frame)
+            if self.waiting_since is None:
+                self.waiting_since = time.monotonic()
+            self._condition.notify()
+        if self.on_ready is not None:
+            self.on_ready()
+        return True
+
+    def get(self) -> bytes or None:
+        """
+        Wait for the next frame.
+
+        :return: The next frame, None once the queue is closed and empty.
+        :rtype: bytes or None
+        """
+        with self._condition:
+            while not self._frames and not self.closed:
+                self._condition.wait()
+            return self._pop()
+
+    def pop(self) -> bytes or None:
+        """
+        Get the next frame without waiting.
+
+        :return: The next frame, None if the queue is empty.
+        :rtype: bytes or None
+        """
+        with self._condition:
+            return self._pop()
+
+    def _pop(self) -> bytes or None:
+        """
+        Get the next frame, the lock must be held.
+
+        :return: The next frame, None if the queue is empty.
+        :rtype: bytes or None
+        """
+        if not self._frames:
+            return None
+        ## The frame is still counted until it is written, a client stuck in the middle of a frame is behind
+        return self._frames.popleft()
+
+    def skip(self):
+        """
+        Count a frame not queued because the client was too slow. Can be called from any thread.
+        """
+        with self._condition:
+            self.skipped += 1
+
+    def written(self, sent:int):
+        """
+        Record that the writer wrote to the client, all or part of a frame.
+
+        :param int sent: The number of bytes written.
+        """
+        with self._condition:
+            self.size = max(0, self.size - sent)
+            self.last_write = time.monotonic()
+            self.waiting_since = self.last_write if self.size else None
+
+    def stalled(self) -> float:
+        """
+        Get the time the queue has been waiting without the writer writing to the client.
+
+        :return: The time in seconds, 0 if everything queued was written.
+        :rtype: float
+        """
+        waiting_since = self.waiting_since
+        return time.monotonic() - waiting_since if waiting_since is not None else 0.0
+
+    def close(self, discard:bool=False):
+        """
+        Close the queue. The frames already queued are still written unless discarded.
+
+        :param bool discard: Whether to drop the frames already queued.
+        """
+        with self._condition:
+            self.closed = True
+            if discard:
+                self._frames.clear()
+                self.size = 0
+            self._condition.notify_all()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def __len__(self) -> int:
+        """
+        Get the number of frames in the queue.
+        """
+        return len(self._frames)
@@ -0,0 +1,170 @@
+import threading
+import logging
+import time
+from collections import deque
+
+## Import the types for documentation purposes
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .database import DatabaseConnection
+    from datetime import datetime
+
+class MessageWriter:
+    """
+    Write-behind persistence of the public messages.
+
+    Messages are queued in memory and written by a background thread, several at once in a single
+    transaction, when the batch is full or when the oldest queued message has waited long enough.
+    The messages are fanned out without waiting for the database.
+
+    :ivar DatabaseConnection database: The database connection.
+    :ivar int batch_size: The maximum number of messages written in a transaction.
+    :ivar float interval: The maximum time in seconds a message waits before its batch is written.
+    :ivar int max_queued: The maximum number of queued messages, senders wait when it is reached.
+    :ivar int written: The number of messages written.
+    :ivar int failed: The number of messages which couldn't be written.
+    :ivar int batches: The number of transactions.
+    :ivar float last_lag: The time in seconds between the queuing and the commit of the oldest message of the last batch.
+    :ivar float max_lag: The highest lag since the start.
+    """
+    def __init__(self, database:'DatabaseConnection', batch_size:int=100, interval_ms:int=50, max_queued:int=10000):
+        """
+        Initialize the MessageWriter. The writer thread is started by start().
+
+        :param DatabaseConnection database: The database connection.
+        :param int batch_size: The maximum number of messages written in a transaction.
+        :param int interval_ms: The maximum time in milliseconds a message waits before its batch is written.
+        :param int max_queued: The maximum number of queued messages.
+        """
+        self.database = database
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.max_queued = max_queued
+
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run, name="message-writer", daemon=True)
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        self._thread.start()
+
+    def put(self, user:str, room:str, date_message:'datetime', body:str):
+        """
+        Queue a message to be written. Waits while the queue is full.
+
+        :param str user: The sender.
+        :param str room: The room.
+        :param datetime date_message: The date of the message.
+        :param str body: The content of the message.
+        :raises RuntimeError: If the writer is closed.
+        """
+        with self._condition:
+            while len(self._queue) >= self.max_queued and not self._stopping:
+                self._condition.wait()
+            if self._stopping:
+                raise RuntimeError("Message writer is closed")
+            self._queue.append((time.monotonic(), {'user':user,
+                                                   'room':room,
+                                                   'date_message':date_message,
+                                                   'body':body}))
+            self._condition.notify_all()
+
+    def run(self):
+        """
+        Write the queued messages by batches until the writer is closed and the queue is empty.
+        """
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if not self._queue:
+                    ## Stopping and everything is written
+                    break
+
+                ## Wait for a full batch, no longer than the interval after the oldest message
+                deadline = self._queue[0][0] + self.interval
+                while len(self._queue) < self.batch_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                ## Wake up the senders waiting for room in the queue
+                self._condition.notify_all()
+
+            self.write(batch)
+
+    def write(self, batch:list):
+        """
+        Write a batch of messages in a single transaction. If the transaction fails, the messages are
+        written one by one, so a single bad message doesn't lose the others.
+
+        :param list batch: The queued messages, as (time queued, parameters) tuples.
+        """
+        try:
+            self.database.insert_messages([params for _, params in batch])
+            self.written += len(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                logging.error(f"Failed to write a message: {e}")
+                self.failed += 1
+            else:
+                logging.warning(f"Failed to write {len(batch)} messages, writing them one by one: {e}")
+                for _, params in batch:
+                    try:
+                        self.database.insert_messages([params])
+                        self.written += 1
+                    except Exception as e:
+                        logging.error(f"Failed to write a message: {e}")
+                        self.failed += 1
+        self.batches += 1
+        self.last_lag = time.monotonic() - batch[0][0]
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+    def close(self):
+        """
+        Stop accepting messages, write the ones queued and wait for the writer thread to end.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    ############################################################################################################
+
+    def lag(self) -> float:
+        """
+        Get the time the oldest queued message has been waiting.
+
+        :return: The time in seconds, 0 if the queue is empty.
+        :rtype: float
+        """
+        with self._condition:
+            return time.monotonic() - self._queue[0][0] if self._queue else 0.0
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the writer.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        return {'queued':len(self._queue),
+                'written':self.written,
+                'failed':self.failed,
+                'batches':self.batches,
+                'lag_ms':round(self.lag() * 1000, 1),
+                'last_lag_ms':round(self.last_lag * 1000, 1),
+                'max_lag_ms':round(self.max_lag * 1000, 1)}
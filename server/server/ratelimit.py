@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TokenBucket:
+    """
+    Token bucket: a message takes a token, the bucket is refilled at a steady rate up to its size,
+    so a client can send a burst of messages but not more than the rate in the long run.
+
+    :ivar float rate: The number of tokens added per second.
+    :ivar float burst: The maximum number of tokens.
+    :ivar float tokens: The number of tokens left.
+    :ivar float updated: The time the tokens were last counted.
+    """
+    def __init__(self, rate:float, burst:float):
+        """
+        Initialize the TokenBucket, full.
+
+        :param float rate: The number of tokens added per second.
+        :param float burst: The maximum number of tokens.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now:float):
+        """
+        Add the tokens earned since the last count.
+
+        :param float now: The current time, from time.monotonic().
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class RateLimiter:
+    """
+    Flood control of the messages of the clients, with a token bucket per username and one per IP address
+    for each limited type of message. A message is refused if either bucket is empty.
+
+    The buckets of the least recently seen users and IP addresses are forgotten past max_buckets, a
+    forgotten bucket is full again like the bucket of a client idle for long.
+
+    :ivar dict user_limits: The (rate per second, burst) of each type of message per username.
+    :ivar dict ip_limits: The (rate per second, burst) of each type of message per IP address.
+    :ivar int max_buckets: The maximum number of buckets kept.
+    :ivar dict limited: The number of messages refused for each type of message.
+    :ivar int limited_users: The number of messages refused by the bucket of a username.
+    :ivar int limited_ips: The number of messages refused by the bucket of an IP address.
+    """
+    def __init__(self, user_limits:dict=None, ip_limits:dict=None, max_buckets:int=100000):
+        """
+        Initialize the RateLimiter.
+
+        :param dict user_limits: The (rate per second, burst) of each type of message per username.
+        :param dict ip_limits: The (rate per second, burst) of each type of message per IP address.
+        :param int max_buckets: The maximum number of buckets kept.
+        """
+        self.user_limits = dict(user_limits or {})
+        self.ip_limits = dict(ip_limits or {})
+        self.max_buckets = max_buckets
+
+        self.limited = {}
+        self.limited_users = 0
+        self.limited_ips = 0
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key:tuple, limit:tuple, now:float) -> TokenBucket:
+        """
+        Get the bucket of a key, refilled, creating it if needed. The lock must be held.
+
+        :param tuple key: The key, the kind of key, the username or IP address and the type of message.
+        :param tuple limit: The (rate per second, burst) of the bucket.
+        :param float now: The current time, from time.monotonic().
+        :return: The bucket.
+        :rtype: TokenBucket
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.refill(now)
+        return bucket
+
+    def allow(self, message_type:str, user:str or None, ip:str) -> bool:
+        """
+        Take a token for a message, from the buckets of its sender.
+
+        :param str message_type: The type of the message.
+        :param str or None user: The username of the sender, None if not logged in.
+        :param str ip: The IP address of the sender.
+        :return: False if the message must be refused.
+        :rtype: bool
+        """
+        user_limit = self.user_limits.get(message_type) if user else None
+        ip_limit = self.ip_limits.get(message_type)
+        if user_limit is None and ip_limit is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            if user_limit is not None:
+                buckets.append(self._bucket(('user', user, message_type), user_limit, now))
+            if ip_limit is not None:
+                buckets.append(self._bucket(('ip', ip, message_type), ip_limit, now))
+
+            ## Only take the tokens if every bucket has one
+            empty = [bucket for bucket in buckets if bucket.tokens < 1]
+            if not empty:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+                return True
+
+            self.limited[message_type] = self.limited.get(message_type, 0) + 1
+            if user_limit is not None and buckets[0] in empty:
+                self.limited_users += 1
+            else:
+                self.limited_ips += 1
+            return False
+
+    ############################################################################################################
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the flood control.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        stats = {'buckets':len(self._buckets),
+                 'limited_users':self.limited_users,
+                 'limited_ips':self.limited_ips}
+        for message_type, count in sorted(self.limited.items()):
+            stats['limited_' + message_type] = count
+        return stats
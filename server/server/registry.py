@@ -0,0 +1,236 @@
+import threading
+
+## Import the types for documentation purposes
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .client import Client
+
+class RoomIndex:
+    """
+    Index of the connected clients of each room, so a message is only sent to the members of its room.
+
+    :ivar function on_first: Called with a room when it gets its first connected member, None if not needed.
+    :ivar function on_last: Called with a room when its last connected member leaves, None if not needed.
+    :ivar dict _members: The set of connected clients of each room.
+    :ivar threading.Lock _lock: The lock protecting the index, clients are handled by several threads.
+    :ivar set _active: The rooms on_first was called for and on_last wasn't since.
+    :ivar threading.Lock _active_lock: The lock ordering the calls of on_first and on_last.
+    """
+    def __init__(self, on_first:'function'=None, on_last:'function'=None):
+        """
+        Initialize the RoomIndex with no member.
+
+        :param function on_first: Called with a room when it gets its first connected member.
+        :param function on_last: Called with a room when its last connected member leaves.
+        """
+        self.on_first = on_first
+        self.on_last = on_last
+        self._members = {}
+        self._lock = threading.Lock()
+        self._active = set()
+        self._active_lock = threading.Lock()
+
+    def _add(self, client:'Client', room:str) -> bool:
+        """
+        Add a client to the members of a room, called with the lock held.
+
+        :param Client client: The client.
+        :param str room: The room.
+        :return: True if the client is the first member of the room.
+        :rtype: bool
+        """
+        members = self._members.get(room)
+        first = members is None
+        if first:
+            members = self._members[room] = set()
+        members.add(client)
+        return first
+
+    def _notify(self, rooms:list):
+        """
+        Call on_first or on_last for the rooms which got their first member or lost their last one, without
+        holding the lock of the index, so a slow callback doesn't stall the other joins and the broadcasts.
+        The calls are made one at a time from the current state of the index, so a room joined and left by
+        several threads at once ends up with the right call last.
+
+        :param list rooms: The rooms which may have changed.
+        """
+        if not rooms or (self.on_first is None and self.on_last is None):
+            return
+        with self._active_lock:
+            for room in rooms:
+                with self._lock:
+                    has_members = room in self._members
+                if has_members and room not in self._active:
+                    self._active.add(room)
+                    if self.on_first is not None:
+                        self.on_first(room)
+                elif not has_members and room in self._active:
+                    self._active.discard(room)
+                    if self.on_last is not None:
+                        self.on_last(room)
+
+    def join(self, client:'Client', room:str):
+        """
+        Add a client to the members of a room.
+
+        :param Client client: The client.
+        :param str room: The room.
+        """
+        with self._lock:
+            first = self._add(client, room)
+        if first:
+            self._notify([room])
+
+    def join_all(self, client:'Client', rooms:list):
+        """
+        Add a client to the members of several rooms.
+
+        :param Client client: The client.
+        :param list rooms: The rooms.
+        """
+        with self._lock:
+            changed = [room for room in rooms if self._add(client, room)]
+        self._notify(changed)
+
+    def leave_all(self, client:'Client', rooms:list):
+        """
+        Remove a client from the members of several rooms.
+
+        :param Client client: The client.
+        :param list rooms: The rooms.
+        """
+        changed = []
+        with self._lock:
+            for room in rooms:
+                members = self._members.get(room)
+                if members is not None:
+                    members.discard(client)
+                    ## Forget the rooms without connected members
+                    if not members:
+                        del self._members[room]
+                        changed.append(room)
+        self._notify(changed)
+
+    def members(self, room:str) -> list:
+        """
+        Get the connected clients of a room.
+
+        :param str room: The room.
+        :return: A copy of the connected clients of the room, safe to iterate while the index changes.
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._members.get(room, ()))
+
+class ClientRegistry:
+    """
+    Registry of the connected clients, indexed by username and by IP address.
+
+    It can be used like the list of clients it replaces (append, remove, iteration, len, in).
+
+    :ivar dict _clients: The connected clients, as the keys of a dict to be removed in constant time.
+    :ivar dict _by_name: The client of each username.
+    :ivar dict _by_ip: The set of clients of each IP address.
+    :ivar threading.RLock _lock: The lock protecting the registry, clients are handled by several threads.
+    """
+    def __init__(self):
+        """
+        Initialize the ClientRegistry with no client.
+        """
+        self._clients = {}
+        self._by_name = {}
+        self._by_ip = {}
+        self._lock = threading.RLock()
+
+    def append(self, client:'Client'):
+        """
+        Register a new client.
+
+        :param Client client: The client.
+        """
+        with self._lock:
+            self._clients[client] = None
+            self._by_ip.setdefault(client.ip[0], set()).add(client)
+            if client.name:
+                self._by_name[client.name] = client
+
+    def remove(self, client:'Client'):
+        """
+        Unregister a client.
+
+        :param Client client: The client.
+        :raises ValueError: If the client is not registered.
+        """
+        with self._lock:
+            if client not in self._clients:
+                raise ValueError("Client is not registered")
+            del self._clients[client]
+            clients = self._by_ip.get(client.ip[0])
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self._by_ip[client.ip[0]]
+            ## Another connection may have logged in with the same username since
+            if self._by_name.get(client.name) is client:
+                del self._by_name[client.name]
+
+    def rename(self, client:'Client', old_name:str, new_name:str):
+        """
+        Update the username of a client in the index.
+
+        :param Client client: The client.
+        :param str old_name: The previous username of the client.
+        :param str new_name: The new username of the client.
+        """
+        with self._lock:
+            if client not in self._clients:
+                ## Not registered yet, indexed when appended
+                return
+            if old_name and self._by_name.get(old_name) is client:
+                del self._by_name[old_name]
+            if new_name:
+                self._by_name[new_name] = client
+
+    def by_name(self, name:str) -> 'Client' or None:
+        """
+        Get the connected client with a username.
+
+        :param str name: The username.
+        :return: The client, None if no client with this username is connected.
+        :rtype: Client or None
+        """
+        with self._lock:
+            return self._by_name.get(name)
+
+    def by_ip(self, ip:str) -> list:
+        """
+        Get the connected clients with an IP address.
+
+        :param str ip: The IP address.
+        :return: The clients with this IP address.
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._by_ip.get(ip, ()))
+
+    ############################################################################################################
+
+    def __iter__(self):
+        """
+        Iterate over a copy of the connected clients, safe while clients connect and disconnect.
+        """
+        with self._lock:
+            return iter(list(self._clients))
+
+    def __len__(self) -> int:
+        """
+        Get the number of connected clients.
+        """
+        return len(self._clients)
+
+    def __contains__(self, client:'Client') -> bool:
+        """
+        Check if a client is registered.
+        """
+        return client in self._clients
@@ -0,0 +1,138 @@
+import threading
+import logging
+import time
+from datetime import datetime, timedelta
+
+## Import the types for documentation purposes
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .database import DatabaseConnection
+    from .rooms import RoomCatalog
+
+class Archiver:
+    """
+    Retention of the messages: the messages older than the retention of their room are moved from the
+    messages table to the messages_archive table by a background thread, so the table written and read
+    by the chat only holds the recent messages.
+
+    The messages are moved by batches, each in its own transaction, so the chat never waits long for the
+    rows locked by the archiver.
+
+    :ivar DatabaseConnection database: The database connection.
+    :ivar RoomCatalog room_catalog: The rooms.
+    :ivar int retention_days: The number of days the messages of a room stay in the messages table, forever if 0.
+    :ivar dict room_retention: The number of days of the rooms kept longer or shorter than retention_days.
+    :ivar float interval: The time in seconds between two runs.
+    :ivar int batch_size: The maximum number of messages moved in a transaction.
+    :ivar int archived: The number of messages moved.
+    :ivar int failed: The number of batches which couldn't be moved.
+    :ivar int runs: The number of runs.
+    :ivar float last_run: The time in seconds the last run took.
+    """
+    def __init__(self, database:'DatabaseConnection', room_catalog:'RoomCatalog', retention_days:int=0,
+                 room_retention:dict=None, interval:float=3600, batch_size:int=1000):
+        """
+        Initialize the Archiver. The archiver thread is started by start().
+
+        :param DatabaseConnection database: The database connection.
+        :param RoomCatalog room_catalog: The rooms.
+        :param int retention_days: The number of days the messages stay in the messages table, forever if 0.
+        :param dict room_retention: The number of days of some rooms, overriding retention_days.
+        :param float interval: The time in seconds between two runs.
+        :param int batch_size: The maximum number of messages moved in a transaction.
+        """
+        self.database = database
+        self.room_catalog = room_catalog
+        self.retention_days = retention_days
+        self.room_retention = dict(room_retention or {})
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.archived = 0
+        self.failed = 0
+        self.runs = 0
+        self.last_run = 0.0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="archiver", daemon=True)
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Check if the messages of a room can expire.
+
+        :return: True if a retention is set.
+        :rtype: bool
+        """
+        return self.retention_days > 0 or any(days > 0 for days in self.room_retention.values())
+
+    def retention(self, room:str) -> int:
+        """
+        Get the retention of a room.
+
+        :param str room: The room.
+        :return: The number of days the messages of the room stay in the messages table, forever if 0.
+        :rtype: int
+        """
+        return self.room_retention.get(room, self.retention_days)
+
+    def start(self):
+        """
+        Start the archiver thread, if a retention is set.
+        """
+        if self.enabled:
+            self._thread.start()
+
+    def run(self):
+        """
+        Archive the old messages at every interval until the archiver is closed.
+        """
+        while not self._stop.wait(self.interval):
+            self.archive()
+
+    def archive(self):
+        """
+        Move the messages older than the retention of their room to the archive, a batch at a time.
+        """
+        start = time.monotonic()
+        now = datetime.now()
+        for room in self.room_catalog.names():
+            days = self.retention(room)
+            if days <= 0:
+                continue
+            cutoff = now - timedelta(days=days)
+            while not self._stop.is_set():
+                try:
+                    moved = self.database.archive_messages(room, cutoff, self.batch_size)
+                except Exception as e:
+                    logging.error(f"Failed to archive the messages of {room}: {e}")
+                    self.failed += 1
+                    break
+                self.archived += moved
+                if moved < self.batch_size:
+                    break
+        self.runs += 1
+        self.last_run = time.monotonic() - start
+
+    def close(self):
+        """
+        Stop archiving, the batch being moved is finished.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    ############################################################################################################
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of the archiver.
+
+        :return: The metrics.
+        :rtype: dict
+        """
+        return {'enabled':self.enabled,
+                'archived':self.archived,
+                'failed':self.failed,
+                'runs':self.runs,
+                'last_run_ms':round(self.last_run * 1000, 1)}
@@ -0,0 +1,115 @@
+import threading
+import logging
+
+## Import the types for documentation purposes
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .database import DatabaseConnection
+
+class RoomCatalog:
+    """
+    In-memory catalog of the rooms, loaded once from the database and updated when rooms are created,
+    so the handlers never query the database to know if a room exists.
+
+    With several servers on the same database, the catalog can be reconciled periodically to see
+    the rooms created by the others.
+
+    :ivar dict _rooms: The type of each room, 'public' or 'private'.
+    :ivar list _public: The names of the public rooms, rebuilt when the catalog changes.
+    :ivar threading.Lock _lock: The lock protecting the catalog.
+    """
+    def __init__(self):
+        """
+        Initialize the RoomCatalog with no room.
+        """
+        self._rooms = {}
+        self._public = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self, rooms:dict):
+        """
+        Replace the content of the catalog.
+
+        :param dict rooms: The type of each room.
+        """
+        with self._lock:
+            self._rooms = dict(rooms)
+            self._public = [name for name, room_type in self._rooms.items() if room_type == 'public']
+
+    def add(self, room:str, room_type:str='public'):
+        """
+        Add a room to the catalog.
+
+        :param str room: The room.
+        :param str room_type: The type of the room, 'public' or 'private'.
+        """
+        with self._lock:
+            if room not in self._rooms and room_type == 'public':
+                self._public = self._public + [room]
+            self._rooms[room] = room_type
+
+    def exists(self, room:str) -> bool:
+        """
+        Check if a room exists.
+
+        :param str room: The room.
+        :return: True if the room exists.
+        :rtype: bool
+        """
+        return room in self._rooms
+
+    def names(self) -> list:
+        """
+        Get every room.
+
+        :return: The names of the rooms, public and private.
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._rooms)
+
+    def public(self) -> list:
+        """
+        Get the public rooms.
+
+        :return: The names of the public rooms. The list must not be modified.
+        :rtype: list
+        """
+        return self._public
+
+    ############################################################################################################
+
+    def reconcile(self, database:'DatabaseConnection'):
+        """
+        Reload the catalog from the database.
+
+        :param DatabaseConnection database: The database connection.
+        """
+        rooms = database.get_all_rooms()
+        if rooms is not None:
+            self.load(rooms)
+
+    def start_reconcile(self, database:'DatabaseConnection', interval:float):
+        """
+        Reload the catalog from the database periodically, in a background thread.
+
+        :param DatabaseConnection database: The database connection.
+        :param float interval: The time in seconds between two reloads.
+        """
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.reconcile(database)
+                except Exception as e:
+                    logging.error(f"Failed to reconcile the rooms: {e}")
+
+        self._thread = threading.Thread(target=run, name="room-reconcile", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stop reloading the catalog.
+        """
+        self._stop.set()
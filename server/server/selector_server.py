@@ -0,0 +1,358 @@
+import selectors
+import socket
+import threading
+import logging
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .client import Client
+from .server import Server
+from .message_handler import handle_message
+from .framing import FrameError
+
+## Import the types for documentation purposes
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .registry import ClientRegistry
+    from .config import Config
+
+class SelectorClient(Client):
+    """
+    A client connected to the selector server. Its non-blocking socket is read and written by the selector
+    loop of the server, its messages are handled in order by the threads of the server's executor.
+
+    :ivar deque _inbox: The messages received and not handled yet, None once the connection is closed.
+    :ivar threading.Lock _inbox_lock: The lock protecting the inbox, filled by the loop and emptied by a handler thread.
+    :ivar bool _scheduled: Whether a handler thread is emptying the inbox.
+    :ivar memoryview _frame: The rest of the frame being written.
+    :ivar bool _reading: Whether the connection is still read.
+    :ivar int _events: The events the socket is registered for, 0 if not registered.
+    """
+    def __init__(self, conn:'socket.socket', address:str, host:str, port:int, clients:'ClientRegistry', server:'SelectorServer'):
+        """
+        Initialize the SelectorClient, called by the selector loop.
+
+        :param socket.socket conn: The client's socket connection.
+        :param str address: The client's IP address.
+        :param str host: The host address.
+        :param int port: The port number.
+        :param ClientRegistry clients: The registry of clients.
+        :param SelectorServer server: The server.
+        """
+        conn.setblocking(False)
+        self._inbox = deque()
+        self._inbox_lock = threading.Lock()
+        self._scheduled = False
+        self._frame = None
+        self._reading = True
+        self._events = 0
+        super().__init__(conn, address, host, port, clients, server)
+
+    def start(self, clients:'ClientRegistry', server:'SelectorServer'):
+        """
+        Register the socket in the selector of the server, no thread is started.
+
+        :param ClientRegistry clients: The registry of clients.
+        :param SelectorServer server: The server.
+        """
+        self.outbox.on_ready = self._notify_writer
+        self._register(selectors.EVENT_READ)
+
+    def _register(self, events:int):
+        """
+        Change the events the socket is registered for, called by the loop.
+
+        :param int events: The events, 0 to unregister the socket.
+        """
+        if events == self._events:
+            return
+        if not self._events:
+            self.server.selector.register(self.conn, events, self.on_event)
+        elif not events:
+            self.server.selector.unregister(self.conn)
+        else:
+            self.server.selector.modify(self.conn, events, self.on_event)
+        self._events = events
+
+    def _notify_writer(self):
+        """
+        Make the loop write the queued frames. Can be called from any thread.
+        """
+        self.server.call_soon(self.flush)
+
+    ############################################################################################################
+
+    def on_event(self, mask:int):
+        """
+        Read or write the socket when it is ready, called by the loop.
+
+        :param int mask: The events the socket is ready for.
+        """
+        if mask & selectors.EVENT_READ:
+            self.read()
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+
+    def read(self):
+        """
+        Read the socket and pass the completed messages to the handler threads, called by the loop.
+        """
+        try:
+            messages = self.receive()
+        except BlockingIOError:
+            return
+        except (FrameError, UnicodeDecodeError) as e:
+            logging.error(f"Invalid frame: {e}")
+            messages = None
+        except (ConnectionResetError):
+            logging.error("Connection reset")
+            messages = None
+        except OSError as e:
+            if not self.outbox.closed:
+                logging.error(f"Unexpected error: {e}")
+            messages = None
+
+        if messages is None:
+            ## Stop reading, the client is closed once its messages are handled
+            self._reading = False
+            self._register(self._events & ~selectors.EVENT_READ)
+            self.dispatch(None)
+            return
+        for data in messages:
+            self.dispatch(data)
+
+    def dispatch(self, data:str or None):
+        """
+        Queue a message to be handled, by a handler thread if none is handling the messages of the client.
+
+        :param str or None data: The message, None to close the client once the messages before are handled.
+        """
+        with self._inbox_lock:
+            self._inbox.append(data)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self.server.executor.submit(self.handle_inbox)
+        except RuntimeError:
+            ## The executor is shut down, the server is stopping
+            with self._inbox_lock:
+                self._scheduled = False
+
+    def handle_inbox(self):
+        """
+        Handle the queued messages in order until the inbox is empty, in a handler thread.
+        """
+        clients = self.server.clients
+        while True:
+            with self._inbox_lock:
+                if not self._inbox:
+                    self._scheduled = False
+                    return
+                data = self._inbox.popleft()
+
+            ## Stop once the client is closed, by a disconnect message or by the server
+            if self.server.stop_clients or self not in clients:
+                continue
+            if data is None:
+                ## Forget the client if the connection dropped without a disconnect message
+                self.drop()
+                continue
+            try:
+                message = json.loads(data)
+                handle_message(message, self, clients, self.server)
+            except json.JSONDecodeError:
+                logging.error("Failed to decode JSON")
+            except Exception as e:
+                logging.error(f"Unexpected error: {e}")
+                self.drop()
+
+    def flush(self):
+        """
+        Write the queued frames until the socket can't take more, called by the loop.
+        The socket is closed once the outbox is closed and empty.
+        """
+        if self.conn.fileno() < 0:
+            return
+        while True:
+            if self._frame is None:
+                frame = self.outbox.pop()
+                if frame is None:
+                    break
+                self._frame = memoryview(frame)
+            try:
+                sent = self.conn.send(self._frame)
+            except BlockingIOError:
+                sent = 0
+            except OSError as e:
+                ## An aborted connection is expected to fail
+                if not self.outbox.closed:
+                    logging.error(f"Failed to send to client: {e}")
+                self.outbox.close(discard=True)
+                self.release()
+                return
+            if sent:
+                self.outbox.written(sent)
+            if sent < len(self._frame):
+                ## Wait for the socket to be writable
+                self._frame = self._frame[sent:]
+                self._register(self._events | selectors.EVENT_WRITE)
+                return
+            self._frame = None
+
+        if self.outbox.closed:
+            self.release()
+        else:
+            self._register(selectors.EVENT_READ if self._reading else 0)
+
+    def abort(self):
+        """
+        Shut the socket down and let the loop close it. Can be called from any thread.
+        """
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.call_soon(self.release)
+
+    def release(self):
+        """
+        Unregister and close the socket, called by the loop.
+        """
+        if self.conn.fileno() < 0:
+            return
+        self._register(0)
+        self.conn.close()
+
+class SelectorServer(Server):
+    """
+    A Server reading and writing every connection in a single selector loop, without a thread per client.
+    The complete messages are handled by a bounded thread pool, those of a client one at a time and in
+    order, so the number of threads doesn't grow with the number of clients.
+
+    :ivar ThreadPoolExecutor executor: The executor running the message handlers.
+    :ivar selectors.BaseSelector selector: The selector of the sockets.
+    :ivar deque _calls: The functions to call in the loop, queued by the other threads.
+    :ivar socket.socket _wake_recv: The socket waking up the loop, read by the loop.
+    :ivar socket.socket _wake_send: The socket waking up the loop, written by the other threads.
+    """
+    def __init__(self, host:str, port:int, config:'Config'=None):
+        """
+        Initialize the SelectorServer.
+
+        :param str host: The host address.
+        :param int port: The port number.
+        :param Config config: The settings of the server, defaults if None.
+        """
+        super().__init__(host, port, config)
+        self.executor = ThreadPoolExecutor(max_workers=self.config.handler_threads, thread_name_prefix="handler")
+        ## A handler waiting for its password to be checked holds a thread of the pool until bcrypt is done,
+        ## keep most of the threads for the other messages, the logins past it get a server_busy error
+        self.passwords.max_pending = min(self.passwords.max_pending, max(1, self.config.handler_threads // 4))
+        self.selector = selectors.DefaultSelector()
+        self._calls = deque()
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+
+    ############################################################################################################
+
+    def run(self):
+        """
+        Run the selector loop until the server is closed.
+        """
+        logging.info("Running selector server")
+        try:
+            sock = self.create_socket()
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, self.accept)
+            self.selector.register(self._wake_recv, selectors.EVENT_READ, self.on_wake)
+
+            while not self.stop_server:
+                self.poll()
+
+            ## Close all client connections, and give the loop some time to send what is queued
+            self.close_clients()
+            deadline = time.monotonic() + 0.5
+            while len(self.selector.get_map()) > 2 and time.monotonic() < deadline:
+                self.poll(deadline - time.monotonic())
+
+            self.selector.unregister(sock)
+            sock.close()
+        except Exception as e:
+            logging.error(f"Failed to run the server: {e}")
+        finally:
+            self.executor.shutdown(wait=False)
+            self.selector.close()
+            self._wake_recv.close()
+            self._wake_send.close()
+
+    def poll(self, timeout:float=None):
+        """
+        Wait for the sockets to be ready and handle them, then call the functions queued by the other threads.
+
+        :param float timeout: The maximum time in seconds to wait, forever if None.
+        """
+        for key, mask in self.selector.select(timeout):
+            key.data(mask)
+        while self._calls:
+            try:
+                self._calls.popleft()()
+            except Exception as e:
+                logging.error(f"Unexpected error: {e}")
+
+    def accept(self, mask:int):
+        """
+        Accept a new client connection, called by the loop.
+
+        :param int mask: The events the server socket is ready for.
+        """
+        try:
+            conn, address = self.sock.accept()
+        except BlockingIOError:
+            ## Accepted by another worker sharing the port
+            return
+        except OSError as e:
+            if not self.stop_server:
+                logging.error(f"Failed to handle a client: {e}")
+            return
+        try:
+            SelectorClient(conn, address, self.host, self.port, self.clients, self)
+        except Exception as e:
+            logging.error(f"Failed to handle a client: {e}")
+            conn.close()
+
+    def on_wake(self, mask:int):
+        """
+        Empty the wake-up socket, called by the loop.
+
+        :param int mask: The events the socket is ready for.
+        """
+        try:
+            while self._wake_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def call_soon(self, function:'function'):
+        """
+        Call a function in the loop. Can be called from any thread.
+
+        :param function function: The function, without argument.
+        """
+        self._calls.append(function)
+        self.wake()
+
+    def wake(self):
+        """
+        Wake up the loop so it sees the queued functions or that the server is stopping.
+        """
+        try:
+            self._wake_send.send(b'\0')
+        except BlockingIOError:
+            ## Already woken up
+            pass
+        except OSError:
+            ## The loop has ended
+            pass
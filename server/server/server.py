@@ -1,9 +1,21 @@
 import time
 import socket
+import threading
+import itertools
 import logging
 import json
 from .client import Client
 from .database import DatabaseConnection
+from .persistence import MessageWriter
+from .retention import Archiver
+from .bus import create_bus
+from .fanout import Fanout
+from .auth import PasswordHasher
+from .rooms import RoomCatalog
+from .ratelimit import RateLimiter
+from .registry import ClientRegistry, RoomIndex
+from .config import Config
+from .framing import encode_frame
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -17,39 +29,116 @@ class Server:
     :ivar bool stop_clients: Flag to stop the clients.
     :ivar str host: The host address.
     :ivar int port: The port number.
+    :ivar Config config: The settings of the server.
     :ivar DatabaseConnection database: The database connection.
+    :ivar ClientRegistry clients: The connected clients.
+    :ivar RoomCatalog room_catalog: The rooms and their type.
+    :ivar RoomIndex room_members: The connected clients of each room.
+    :ivar MessageWriter message_writer: The write-behind persistence of the public messages.
+    :ivar Archiver archiver: The archiving of the old messages.
+    :ivar PasswordHasher passwords: The pool of processes hashing and checking passwords.
+    :ivar RateLimiter rate_limiter: The flood control of the messages of the clients.
+    :ivar int slow_disconnected: The number of clients disconnected for not reading their messages.
+    :ivar threading.Lock _counters_lock: The lock protecting the counters, updated by several threads.
+    :ivar socket.socket sock: The server socket, once running.
+    :ivar Bus bus: The channel to the other servers of the cluster or workers sharing the port, None if alone.
+    :ivar str node: The name of the server among the servers reached by the bus.
+    :ivar dict _answers: The answers of the other servers to each admin query waiting for them, by server.
+    :ivar threading.Condition _answers_ready: The condition notified when an answer arrives.
     """
 
-    def __init__(self, host:str, port:int):
+    def __init__(self, host:str, port:int, config:Config=None):
         """
-        Initialize the Server with host, port, and database connection.
+        Initialize the Server with host, port, settings, and database connection.
 
         :param str host: The host address.
         :param int port: The port number.
+        :param Config config: The settings of the server, defaults if None.
         :raises Exception: If there is an error during database connection
         """
         logging.info("Initializing server")
 
         self.stop_server = False
         self.stop_clients = False
+        self.slow_disconnected = 0
+        self._counters_lock = threading.Lock()
         self.host = host
         self.port = port
-        self.clients = []
-        self.rooms = []
+        self.sock = None
+        self.config = config if config is not None else Config()
+        self.bus = None
+        self.node = f"{socket.gethostname()}:{port}/{self.config.worker_id}"
+        self._answers = {}
+        self._answers_ready = threading.Condition()
+        self._query_ids = itertools.count(1)
+        self.clients = ClientRegistry()
+        self.room_catalog = RoomCatalog()
+        ## Only receive the messages of the rooms with connected members
+        self.room_members = RoomIndex(self.subscribe_room, self.unsubscribe_room)
         
         ## Initialize database connection
-        self.database = DatabaseConnection()
+        self.database = DatabaseConnection(self.config.user_cache_size, self.config.user_cache_ttl)
         try:
-            self.database.connect()
+            self.database.connect(self.config.database_url,
+                                  self.config.db_pool_size,
+                                  self.config.db_max_overflow,
+                                  self.config.db_pool_timeout,
+                                  self.config.db_pool_recycle,
+                                  self.config.db_pool_pre_ping,
+                                  self.config.sqlite_synchronous,
+                                  self.config.database_replicas)
+            self.database.warm()
         except Exception as e:
             logging.error(f"An error occurred: {e}")
             raise e
 
-        ## Fetch rooms from database
-        rooms = self.database.get_rooms()
-        if rooms is not None:
-            for room in rooms:
-                self.rooms.append(room)
+        ## Start writing the messages to the database in the background
+        self.message_writer = MessageWriter(self.database,
+                                            self.config.persist_batch_size,
+                                            self.config.persist_interval_ms,
+                                            self.config.persist_queue_size)
+        self.message_writer.start()
+
+        self.passwords = PasswordHasher(self.config.auth_workers, self.config.auth_max_pending)
+        self.rate_limiter = RateLimiter(self.config.rate_limits, self.config.ip_rate_limits)
+
+        ## Fetch rooms from database, once
+        self.room_catalog.reconcile(self.database)
+        if self.config.room_reconcile_interval > 0:
+            self.room_catalog.start_reconcile(self.database, self.config.room_reconcile_interval)
+
+        ## Archive the old messages in the background
+        self.archiver = Archiver(self.database,
+                                 self.room_catalog,
+                                 self.config.retention_days,
+                                 self.config.room_retention,
+                                 self.config.retention_interval,
+                                 self.config.retention_batch_size)
+        self.archiver.start()
+
+        ## Share the public messages, the new rooms, the moderation and the modified users with the other servers
+        if self.config.bus_url:
+            self.bus = create_bus(self.config.bus_url, self.deliver)
+        elif self.config.workers > 1:
+            self.bus = Fanout(self.config.fanout_dir, self.config.worker_id, self.config.workers, self.deliver)
+        if self.bus is not None:
+            self.bus.subscribe('rooms')
+            self.bus.subscribe('moderation')
+            self.bus.subscribe('users')
+            self.bus.subscribe('admin')
+            self.bus.subscribe('admin:' + self.node)
+            self.database.on_user_modified = self.publish_user
+            self.bus.start()
+
+    @property
+    def rooms(self) -> list:
+        """
+        Get the public rooms of the server.
+
+        :return: The names of the public rooms.
+        :rtype: list
+        """
+        return self.room_catalog.public()
 
     ############################################################################################################
 
@@ -80,8 +169,12 @@ class Server:
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.config.workers > 1:
+                ## Every worker listens on the port, the kernel spreads the connections between them
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             sock.bind((self.host, self.port))
-            sock.listen(1)
+            self.sock = sock
+            sock.listen(socket.SOMAXCONN)
             return sock
         except Exception as e:
             logging.error(f"Failed to create a socket: {e}")
@@ -102,17 +195,29 @@ class Server:
                 ## Create new client
                 client = Client(conn, address, self.host, self.port, self.clients, self)
             except Exception as e:
-                logging.error(f"Failed to handle a client: {e}")
+                if not self.stop_server:
+                    logging.error(f"Failed to handle a client: {e}")
 
         ## Close all client connections
-        for client in self.clients:
-            client.close(self.clients)
+        self.close_clients()
 
         time.sleep(0.5)
 
         ## Close server socket
         sock.close()
 
+    def close_clients(self):
+        """
+        Close the connections of all the clients, sending what is queued for them first.
+        A client closed by its own handler in the meantime is skipped.
+        """
+        for client in self.clients:
+            try:
+                client.close(self.clients)
+            except ValueError:
+                ## Already closed
+                pass
+
     def close(self):
         """
         Close the server.
@@ -120,12 +225,127 @@ class Server:
         self.stop_server = True
         self.stop_clients = True
 
+        self.wake()
+        if self.bus is not None:
+            self.bus.close()
+
+        ## Write the messages still queued before closing the database
+        self.room_catalog.close()
+        self.archiver.close()
+        self.message_writer.close()
+        self.database.close()
+        self.passwords.close()
+
+    def wake(self):
+        """
+        Wake up the server so it sees it is stopping.
+        """
+        if self.config.workers > 1:
+            ## A connection could reach another worker, shut the server socket down to unblock accept()
+            if self.sock is not None:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            return
         ## Create a socket to unblock the server socket accept() method
         disconnect_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         disconnect_socket.connect((self.host, self.port))
         disconnect_socket.close()
 
-        self.database.close()
+    def stats(self) -> dict:
+        """
+        Get the metrics of the server.
+
+        :return: The metrics of each part of the server.
+        :rtype: dict
+        """
+        timeout = self.config.slow_consumer_timeout
+        clients = list(self.clients)
+        return {'clients':{'connected':len(clients),
+                           'slow':sum(1 for client in clients if timeout > 0 and client.outbox.stalled() > timeout),
+                           'slow_disconnected':self.slow_disconnected,
+                           'skipped':sum(client.outbox.skipped for client in clients)},
+                'persistence':self.message_writer.stats(),
+                'retention':self.archiver.stats(),
+                'auth':self.passwords.stats(),
+                'rate_limit':self.rate_limiter.stats(),
+                'user_cache':self.database.user_cache.stats(),
+                'database_pool':self.database.pool_stats(),
+                'bus':self.bus.stats() if self.bus is not None else {'enabled':False}}
+
+    def slow_clients(self, count:int=10) -> list:
+        """
+        Describe the clients the longest behind in reading their messages.
+
+        :param int count: The maximum number of clients.
+        :return: The name, IP address, bytes and frames waiting, stalled time, time since the last write (None if
+                 never), dropped and skipped frames of each client, the longest without a write first.
+        :rtype: list
+        """
+        now = time.monotonic()
+        return [{'name':client.name,
+                 'ip':client.ip[0],
+                 'size':client.outbox.size,
+                 'frames':len(client.outbox),
+                 'stalled':client.outbox.stalled(),
+                 'last_write':now - client.outbox.last_write if client.outbox.last_write is not None else None,
+                 'dropped':client.outbox.dropped,
+                 'skipped':client.outbox.skipped} for client in self.slowest(count)]
+
+    def count_slow_disconnect(self):
+        """
+        Count a client disconnected for not reading its messages. Can be called from any thread.
+        """
+        with self._counters_lock:
+            self.slow_disconnected += 1
+
+    def slowest(self, count:int=10) -> list:
+        """
+        Get the clients the longest behind in reading their messages.
+
+        :param int count: The maximum number of clients.
+        :return: The clients, the longest without a write first, then the most bytes waiting.
+        :rtype: list
+        """
+        clients = [client for client in self.clients if client.outbox.size or client.outbox.stalled()]
+        clients.sort(key=lambda client: (client.outbox.stalled(), client.outbox.size), reverse=True)
+        return clients[:count]
+
+    ############################################################################################################
+
+    def broadcast(self, room:str, message:dict):
+        """
+        Send a message to the valid clients connected in a room, to this server and to the other servers.
+
+        :param str room: The room.
+        :param dict message: The message.
+        """
+        if self.bus is not None:
+            self.bus.publish('room:' + room, {'type':'message', 'room':room, 'message':message})
+        self.broadcast_local(room, message)
+
+    def broadcast_local(self, room:str, message:dict):
+        """
+        Send a message to the valid clients connected to this server in a room.
+
+        The message is serialized and framed once, the writer of every client gets the same read-only buffer.
+
+        :param str room: The room.
+        :param dict message: The message.
+        """
+        frame = memoryview(encode_frame(json.dumps(message)))
+        for client in self.room_members.members(room):
+            if client.state == "valid":
+                client.send_frame(frame, critical=False)
+
+    def send_all(self, clients:list, message:dict):
+        """
+        Send a message to several clients, serialized and framed once.
+
+        :param list clients: The clients.
+        :param dict message: The message.
+        """
+        frame = memoryview(encode_frame(json.dumps(message)))
+        for client in clients:
+            client.send_frame(frame)
 
     ############################################################################################################
         
@@ -137,7 +357,205 @@ class Server:
         """
         self.database.execute_sql_query("INSERT INTO rooms (name) VALUES (:room)",
                                         {'room':room})
-        self.rooms.append(room)
+        self.register_room(room)
+
+    def register_room(self, room:str, room_type:str='public'):
+        """
+        Add a room created in the database to the catalog, of this server and of the other servers.
+
+        :param str room: The room.
+        :param str room_type: The type of the room, 'public' or 'private'.
+        """
+        self.room_catalog.add(room, room_type)
+        if self.bus is not None:
+            self.bus.publish('rooms', {'type':'room', 'room':room, 'room_type':room_type})
+
+    def subscribe_room(self, room:str):
+        """
+        Receive the messages of a room from the other servers, once it has a connected member.
+
+        :param str room: The room.
+        """
+        if self.bus is not None:
+            self.bus.subscribe('room:' + room)
+
+    def unsubscribe_room(self, room:str):
+        """
+        Stop receiving the messages of a room from the other servers, once it has no connected member.
+
+        :param str room: The room.
+        """
+        if self.bus is not None:
+            self.bus.unsubscribe('room:' + room)
+
+    def deliver(self, event:dict):
+        """
+        Apply an event published by another server.
+
+        :param dict event: The event, a public message, a new room, a moderation, a modified user, a new member of a room,
+                           or an admin query or its answer.
+        """
+        if event['type'] == 'message':
+            self.broadcast_local(event['room'], event['message'])
+        elif event['type'] == 'room':
+            self.room_catalog.add(event['room'], event['room_type'])
+        elif event['type'] == 'moderation':
+            self.apply_moderation(event)
+        elif event['type'] == 'user':
+            self.database.invalidate_user(event['user'])
+        elif event['type'] == 'membership':
+            self.apply_membership(event)
+        elif event['type'] == 'query':
+            self.answer_query(event)
+        elif event['type'] == 'answer':
+            self.receive_answer(event)
+
+    def publish_user(self, user:str):
+        """
+        Make the other servers forget the cached profile of a user modified by this server.
+
+        :param str user: The username.
+        """
+        self.bus.publish('users', {'type':'user', 'user':user})
+
+    ############################################################################################################
+
+    def query(self, name:str, args:dict=None) -> dict:
+        """
+        Run an admin query on this server and on the other servers reached by the bus. The answers of the other
+        servers are awaited for the query timeout at most.
+
+        :param str name: The query, 'stats', 'users' or 'slow'.
+        :param dict args: The arguments of the query.
+        :return: The answer of each server, by name of the server, this one first.
+        :rtype: dict
+        """
+        args = args or {}
+        answers = {self.node: self.answer(name, args)}
+        if self.bus is None:
+            return answers
+
+        query_id = next(self._query_ids)
+        with self._answers_ready:
+            self._answers[query_id] = answers
+        self.bus.publish('admin', {'type':'query', 'id':query_id, 'node':self.node, 'query':name, 'args':args})
+        peers = self.bus.peers()
+        deadline = time.monotonic() + self.config.query_timeout
+        with self._answers_ready:
+            ## Without the number of servers, wait for the whole timeout
+            while peers is None or len(answers) <= peers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._answers_ready.wait(remaining)
+            del self._answers[query_id]
+        return answers
+
+    def answer(self, name:str, args:dict) -> object:
+        """
+        Answer an admin query with the state of this server.
+
+        :param str name: The query, 'stats', 'users' or 'slow'.
+        :param dict args: The arguments of the query.
+        :return: The answer, serializable to JSON.
+        :rtype: object
+        :raises ValueError: If the query is unknown.
+        """
+        if name == 'stats':
+            return self.stats()
+        if name == 'users':
+            return [[client.name, client.ip[0]] for client in self.clients]
+        if name == 'slow':
+            return self.slow_clients(args.get('count', 10))
+        raise ValueError(f"Unknown query: {name}")
+
+    def answer_query(self, event:dict):
+        """
+        Send the answer of this server to an admin query of another server.
+
+        :param dict event: The query.
+        """
+        self.bus.publish('admin:' + event['node'], {'type':'answer',
+                                                    'id':event['id'],
+                                                    'node':self.node,
+                                                    'answer':self.answer(event['query'], event['args'])})
+
+    def receive_answer(self, event:dict):
+        """
+        Record the answer of another server to an admin query of this server.
+
+        :param dict event: The answer.
+        """
+        with self._answers_ready:
+            answers = self._answers.get(event['id'])
+            ## The query may have timed out
+            if answers is not None:
+                answers[event['node']] = event['answer']
+                self._answers_ready.notify_all()
+
+    def add_member(self, user:str, room:str) -> bool:
+        """
+        Add a user to a room in the database, and to the rooms of its client on the server it is connected to.
+
+        :param str user: The username.
+        :param str room: The room.
+        :return: False if the other servers couldn't be told, a client connected to them only gets the room when
+                 its user logs in again.
+        :rtype: bool
+        """
+        self.database.add_membership(user, room)
+        event = {'type':'membership', 'user':user, 'room':room}
+        sent = True
+        if self.bus is not None:
+            sent = self.bus.publish('users', event)
+        self.apply_membership(event)
+        return sent
+
+    def apply_membership(self, event:dict):
+        """
+        Add a room to the rooms of a client connected to this server, once its user was added to it.
+
+        :param dict event: The new member, its username and the room.
+        """
+        client = self.clients.by_name(event['user'])
+        if client is not None:
+            client.join_room(event['room'])
+
+    def moderate(self, event:dict):
+        """
+        Apply a moderation written to the database to the clients of every server.
+
+        :param dict event: The moderation: its action, the user or the IP address, and the message to the clients.
+        """
+        event['type'] = 'moderation'
+        if self.bus is not None:
+            self.bus.publish('moderation', event)
+        self.apply_moderation(event)
+
+    def apply_moderation(self, event:dict):
+        """
+        Apply a moderation to the clients connected to this server.
+
+        The cached profiles are forgotten, the kicked and banned clients leave their rooms and are notified.
+
+        :param dict event: The moderation.
+        """
+        if 'user' in event:
+            self.database.invalidate_user(event['user'])
+            client = self.clients.by_name(event['user'])
+            clients = [client] if client is not None else []
+        else:
+            ## The users of the IP aren't known, forget every cached user
+            self.database.invalidate_user()
+            clients = self.clients.by_ip(event['ip'])
+
+        if 'message' not in event:
+            return
+        if event['action'] != 'kill':
+            for client in clients:
+                client.state = event['action']
+                self.room_members.leave_all(client, client.rooms)
+        self.send_all(clients, event['message'])
     
     def kick_user(self, username:str, timeout:'datetime', reason:str):
         """
@@ -157,15 +575,11 @@ class Server:
                                          'reason':reason,
                                          'timeout':timeout,
                                          'username':username})
-
-        # Check if the user is currently connected
-        for client in self.clients:
-            if client.name == username:
-                client.state = 'kick'
-                client.send(json.dumps({'type':'kick',
-                                        'timeout':timeout.strftime("%Y-%m-%d %H:%M:%S"),
-                                        'reason': reason}))
-                break
+        self.moderate({'action':'kick',
+                       'user':username,
+                       'message':{'type':'kick',
+                                  'timeout':timeout.strftime("%Y-%m-%d %H:%M:%S"),
+                                  'reason': reason}})
     
     def kick_ip(self, ip:str, timeout:'datetime', reason:str):
         """
@@ -185,14 +599,11 @@ class Server:
                                          'reason':ip + ":" + reason,
                                          'timeout':timeout,
                                          'ip':ip})
-
-        # Check if the user is currently connected
-        for client in self.clients:
-            if client.ip[0] == ip:
-                client.state = 'kick_ip'
-                client.send(json.dumps({'type':'kick_ip',
-                                        'timeout':timeout.strftime("%Y-%m-%d %H:%M:%S"),
-                                        'reason':reason}))
+        self.moderate({'action':'kick_ip',
+                       'ip':ip,
+                       'message':{'type':'kick_ip',
+                                  'timeout':timeout.strftime("%Y-%m-%d %H:%M:%S"),
+                                  'reason':reason}})
 
     def unkick_ip(self, ip:str):
         """
@@ -211,6 +622,8 @@ class Server:
                                          'reason':None,
                                          'timeout':None,
                                          'ip':ip})
+        self.moderate({'action':'unkick_ip',
+                       'ip':ip})
         print(f"IP {ip} has been unkicked.")
     
     def unkick_user(self, username:str):
@@ -230,6 +643,8 @@ class Server:
                                          'reason':None,
                                          'timeout':None,
                                          'username':username})
+        self.moderate({'action':'unkick',
+                       'user':username})
         print(f"User {username} has been unkicked.")
     
     def ban_user(self, username:str, reason:str):
@@ -248,14 +663,10 @@ class Server:
                                         {'state':'ban',
                                         'reason':reason,
                                         'username':username})
-        
-        ## Check if the user is currently connected
-        for cl in self.clients:
-            if cl.name == username:
-                cl.state = 'ban'
-                cl.send(json.dumps({'type':'ban',
-                                    'reason':reason}))
-                break
+        self.moderate({'action':'ban',
+                       'user':username,
+                       'message':{'type':'ban',
+                                  'reason':reason}})
 
         print(f"User {username} has been banned for reason: {reason}")
 
@@ -275,12 +686,9 @@ class Server:
                                         {'state':'ban_ip',
                                          'reason':ip + ":" + reason,
                                          'ip':ip})
-
-        ## Check if the user is currently connected
-        for client in self.clients:
-            if client.ip[0] == ip:
-                client.state = 'ban_ip'
-                client.send(json.dumps({'type': 'ban_ip', 'reason': reason}))
+        self.moderate({'action':'ban_ip',
+                       'ip':ip,
+                       'message':{'type': 'ban_ip', 'reason': reason}})
 
         print(f"IP {ip} has been banned for reason: {reason}")
                 
@@ -301,6 +709,8 @@ class Server:
                                             {'state':'valid',
                                              'reason':None,
                                              'ip':ip})
+        self.moderate({'action':'unban_ip',
+                       'ip':ip})
         print(f"IP {ip} has been unbanned.")
     
     def unban_user(self, username:str):
@@ -321,6 +731,8 @@ class Server:
                                         {'state':'valid',
                                         'reason':None,
                                         'username':username})
+        self.moderate({'action':'unban',
+                       'user':username})
         print(f"User {username} has been unbanned.")
     
     def kill(self, user:str, reason:str):
@@ -330,9 +742,8 @@ class Server:
         :param str user: The username.
         :param str reason: The reason for killing the user.
         """
-        for client in self.clients:
-            if client.name == user:
-                client.send(json.dumps({'type':'kill',
-                                        'reason':reason}))
-                break
+        self.moderate({'action':'kill',
+                       'user':user,
+                       'message':{'type':'kill',
+                                  'reason':reason}})
             
\ No newline at end of file
@@ -1,13 +1,14 @@
 import json
 import datetime
-import bcrypt
 import logging
+from .auth import ServerBusy
 
 ## Import the types for documentation purposes
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .client import Client
     from .server import Server
+    from .registry import ClientRegistry
 
 def handle_signup_message(message:dict, client:'Client', _:list, server:'Server'):
     """
@@ -25,27 +26,33 @@ def handle_signup_message(message:dict, client:'Client', _:list, server:'Server'
     """
     user = message['username']
     password = message['password'].encode('utf-8')
-    
-    ## Hash the password
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password, salt)
 
     ## Check if the user already exists
     if not server.database.user_exists(user):
-        client.name = user
+        ## Hash the password in the pool of processes
+        try:
+            hashed_password = server.passwords.hash(password)
+        except ServerBusy:
+            response = json.dumps({'type':'signup',
+                                   'status':'error',
+                                   'reason':'server_busy'})
+            client.send(response)
+            return
 
         creation_date = datetime.datetime.now()
         try:
-            server.database.execute_sql_query("INSERT INTO users (name, password, ip, date_creation) VALUES (:name, :password, :ip, :date_creation)",
-                                              {'name':user,
-                                               'password':hashed_password,
-                                               'ip':client.ip[0],
-                                               'date_creation':creation_date})
-            client.login = True
-            client.state = "valid"
-            client.addroom(server, "Général")
-            response = json.dumps({'type':'signup',
-                                   'status':'ok'})
+            ## The name can be taken by another signup while the password is hashed
+            if server.database.insert_user(user, hashed_password, client.ip[0], creation_date):
+                client.name = user
+                client.login = True
+                client.state = "valid"
+                client.addroom(server, "Général")
+                response = json.dumps({'type':'signup',
+                                       'status':'ok'})
+            else:
+                response = json.dumps({'type':'signup',
+                                       'status':'error',
+                                       'reason':'username_already_used'})
         except Exception as e:
             response = json.dumps({'type':'signup',
                                    'status':'error',
@@ -59,7 +66,7 @@ def handle_signup_message(message:dict, client:'Client', _:list, server:'Server'
 
 ################################################################################################################
 
-def handle_signin_message(message:dict, client:'Client', clients:list, server:'Server'):
+def handle_signin_message(message:dict, client:'Client', clients:'ClientRegistry', server:'Server'):
     """
     Handle signin message from the client.
 
@@ -67,8 +74,8 @@ def handle_signin_message(message:dict, client:'Client', clients:list, server:'S
     :type message: dict
     :param client: The client.
     :type client: 'Client'
-    :param clients: List of all clients.
-    :type clients: list
+    :param clients: The registry of all clients.
+    :type clients: ClientRegistry
     :param server: The server.
     :type server: 'Server'
     :raises Exception: If there is an error during signin
@@ -76,10 +83,21 @@ def handle_signin_message(message:dict, client:'Client', clients:list, server:'S
     user = message['username']
     password = message['password'].encode('utf-8')
 
-    if server.database.user_exists(user):
-        hashed_password = server.database.fetch_user_password(user)
+    ## Load everything about the user in a single query
+    profile = server.database.fetch_user_profile(user)
 
-        if not bcrypt.checkpw(password, hashed_password): 
+    if profile is not None:
+        ## Check the password in the pool of processes
+        try:
+            valid_password = server.passwords.check(password, profile['password'])
+        except ServerBusy:
+            response = json.dumps({'type':'signin',
+                                   'status':'error',
+                                   'reason':'server_busy'})
+            client.send(response)
+            return
+
+        if not valid_password: 
             ## Incorrect password
             response = json.dumps({'type':'signin',
                                    'status':'error',
@@ -87,67 +105,51 @@ def handle_signin_message(message:dict, client:'Client', clients:list, server:'S
             client.send(response)
         else:
             client.name = user
-            client.state = server.database.fetch_user_state(user)
-            server.database.execute_sql_query("UPDATE users SET ip = :ip WHERE name = :name",
-                                              {'ip':client.ip[0],
-                                               'name':user})
-                     
-            result = server.database.fetch_all("SELECT room FROM belong WHERE user = :name",
-                                               {'name':user})
-            client.rooms = [row[0] for row in result] if result else []
-
-            result = server.database.fetch_all("SELECT pending_rooms FROM users WHERE users.name = :name",
-                                               {'name':user})
-            list_result = result[0][0].split(',') if result[0][0] is not None else []
-            client.pending_rooms = list_result
+            client.state = profile['state']
+            if profile['ip'] != client.ip[0]:
+                server.database.update_user_ip(user, client.ip[0])
+
+            client.rooms = profile['rooms']
+            client.pending_rooms = profile['pending_rooms']
              
             if client.state == "valid":
                 ## Valid user
                 response = json.dumps({'type':'signin',
                                        'status':'ok',
-                                       'all_rooms':server.database.get_rooms(),
+                                       'all_rooms':server.rooms,
                                        'rooms':client.rooms,})
                 client.login = True
                 client.send(response)
                                   
             elif client.state == "kick" or client.state == "kick_ip":
                 ## Kicked user
-                result = server.database.fetch_one("SELECT timeout FROM users WHERE name = :name",
-                                                   {'name':user})
-                timeout = result[0] if result else None
+                timeout = profile['timeout']
                 if datetime.datetime.now() > timeout:
                     ## If timeout has expired, unkick the user
                     server.database.execute_sql_query("UPDATE users SET state = 'valid' WHERE name = :name",
                                                       {'name':user})
+                    server.database.user_modified(user)
                     client.state = "valid"
                     response = json.dumps({'type':'signin',
                                            'status':'ok',
-                                           'all_rooms':server.database.get_rooms(),
+                                           'all_rooms':server.rooms,
                                            'rooms':client.rooms,})
                     client.login = True
                     client.send(response)
                 else:
                     ## If timeout has not expired, send a kick status response
-                    result = server.database.fetch_one("SELECT reason FROM users WHERE name = :name",
-                                                    {'name':user})
-                    reason = result[0] if result else None
-
                     response = json.dumps({'type':'signin',
                                         'status':'kick',
                                         'timeout':timeout.strftime("%Y-%m-%d %H:%M:%S"),
-                                        'reason':reason})
+                                        'reason':profile['reason']})
                     client.send(response)
                     client.close(clients)
                                      
             elif client.state == "ban" or client.state == "ban_ip":
                 ## Banned user
-                result = server.database.fetch_one("SELECT reason FROM users WHERE name = :name",
-                                                   {'name':user})
-                reason = result[0] if result else None
-
                 response = json.dumps({'type':'signin',
                                        'status':'ban',
-                                       'reason':reason})
+                                       'reason':profile['reason']})
                 client.send(response)
                 client.close(clients)
     
@@ -160,14 +162,14 @@ def handle_signin_message(message:dict, client:'Client', clients:list, server:'S
 
 ################################################################################################################
 
-def handle_disconnect_message(_1:dict, client:'Client', clients:list, _2:'Server'):
+def handle_disconnect_message(_1:dict, client:'Client', clients:'ClientRegistry', _2:'Server'):
     """
     Handle disconnect message from the client.
 
     :param client: The client.
     :type client: 'Client'
-    :param clients: The list of all clients.
-    :type clients: list
+    :param clients: The registry of all clients.
+    :type clients: ClientRegistry
     :raises ValueError: If the client is not in the list
     :raises Exception: If there is an unexpected error
     """
@@ -203,7 +205,7 @@ def handle_pending_room_message(message:dict, client:'Client', _:list, server:'S
     if client.login:
         room = message['room']
 
-        if not server.database.room_exists(room):
+        if not server.room_catalog.exists(room):
             ## Room doesn't exist
             response = json.dumps({'type':'pending_room',
                                    'status':'error',
@@ -211,11 +213,15 @@ def handle_pending_room_message(message:dict, client:'Client', _:list, server:'S
         elif room not in client.rooms and room is not None:
             if room == "Blabla":
                 client.addroom(server, room)
+                response = None
+            elif room in client.pending_rooms:
+                ## Already requested
+                response = json.dumps({'type':'pending_room',
+                                       'status':'error',
+                                       'reason':'already_pending'})
             else:
                 client.pending_rooms.append(room)
-                server.database.execute_sql_query("UPDATE users SET pending_rooms = :pending_rooms WHERE name = :name",
-                                                  {'pending_rooms':','.join(client.pending_rooms),
-                                                   'name':client.name,})
+                server.database.add_pending_room(client.name, room, datetime.datetime.now())
                 response = None
             
         else:
@@ -236,7 +242,7 @@ def handle_pending_room_message(message:dict, client:'Client', _:list, server:'S
 
 ################################################################################################################
 
-def handle_public_message(message:dict, client:'Client', clients:list, server:'Server'):
+def handle_public_message(message:dict, client:'Client', clients:'ClientRegistry', server:'Server'):
     """
     Handle public message from the client.
 
@@ -244,8 +250,8 @@ def handle_public_message(message:dict, client:'Client', clients:list, server:'S
     :type message: dict
     :param client: The client.
     :type client: 'Client'
-    :param clients: The list of all clients.
-    :type clients: list
+    :param clients: The registry of all clients.
+    :type clients: ClientRegistry
     :param server: The server.
     :type server: 'Server'
     :raises Exception: If there is an error during handling the public message
@@ -258,24 +264,33 @@ def handle_public_message(message:dict, client:'Client', clients:list, server:'S
                                    'status':'error',
                                    'reason':'not_valid_sender'})
             client.send(response)
+        elif not server.room_catalog.exists(message['room']):
+            ## A message to an unknown room couldn't be written to the database
+            response = json.dumps({'type':'public',
+                                   'status':'error',
+                                   'reason':'room_does_not_exist'})
+            client.send(response)
+        elif message['room'] not in client.rooms:
+            ## Only the members of a room can write in it
+            response = json.dumps({'type':'public',
+                                   'status':'error',
+                                   'reason':'not_in_room'})
+            client.send(response)
         else:
-            ## If valid, extract message details and insert into the database
+            ## If valid, extract message details and queue it to be written to the database
             message_text = message['message']
             date_message = datetime.datetime.now()
             room = message['room']
 
             try:
-                server.database.insert_message(client.name, room, date_message, message_text)
-                response = json.dumps({'type':'public',
-                                       'room':room,
-                                       'user':client.name,
-                                       'message':message_text})
+                server.message_writer.put(client.name, room, date_message, message_text)
                 ## Send the message to all valid clients in the room
-                for cl in clients:
-                    if room in cl.rooms and cl.state == "valid":
-                        cl.send(response)
+                server.broadcast(room, {'type':'public',
+                                        'room':room,
+                                        'user':client.name,
+                                        'message':message_text})
             except Exception as e:
-                ## Handle any errors during message insertion
+                ## Handle any errors during message queuing
                 response = json.dumps({'type':'public',
                                        'status':'error',
                                        'reason':str(e)})
@@ -289,7 +304,65 @@ def handle_public_message(message:dict, client:'Client', clients:list, server:'S
 
 ################################################################################################################
 
-def handle_private_message(message:dict, client:'Client', clients:list, server:'Server'):
+def handle_history_message(message:dict, client:'Client', _:list, server:'Server'):
+    """
+    Handle history message from the client, a request for a page of the messages of a room.
+
+    The page holds the messages before the id 'before', the latest ones if it is missing, newest first.
+    At most 'limit' messages are sent, no more than the page size of the server.
+
+    :param message: The history message.
+    :type message: dict
+    :param client: The client.
+    :type client: 'Client'
+    :param _: Unused parameter.
+    :type _: list
+    :param server: The server.
+    :type server: 'Server'
+    """
+    if client.login:
+        room = message.get('room')
+        try:
+            if not isinstance(room, str):
+                raise TypeError("The room must be a string")
+            before = message.get('before')
+            before = None if before is None else int(before)
+            limit = max(1, min(int(message.get('limit') or server.config.history_page_size), server.config.history_page_size))
+        except (TypeError, ValueError):
+            before = limit = None
+
+        if limit is None:
+            ## No room, or the id or the number of messages isn't a number
+            response = json.dumps({'type':'history',
+                                   'status':'error',
+                                   'reason':'invalid_request'})
+        elif room not in client.rooms:
+            ## Only the members of a room can read it
+            response = json.dumps({'type':'history',
+                                   'status':'error',
+                                   'reason':'not_in_room'})
+        else:
+            ## Fetch one more message to know if there is another page
+            rows = server.database.fetch_room_history(room, before, limit + 1)
+            response = json.dumps({'type':'history',
+                                   'status':'ok',
+                                   'room':room,
+                                   'messages':[{'id':row[0],
+                                                'user':row[1],
+                                                'date':row[2].strftime("%Y-%m-%d %H:%M:%S") if row[2] else None,
+                                                'message':row[3]} for row in rows[:limit]],
+                                   'more':len(rows) > limit})
+        client.send(response)
+    else:
+        ## If client is not logged in, send an error response
+        response = json.dumps({'type':'history',
+                               'status':'error',
+                               'reason':'not_logged_in'})
+        client.send(response)
+
+################################################################################################################
+
+def handle_private_message(message:dict, client:'Client', clients:'ClientRegistry', server:'Server'):
     """
     Handle private message from the client.
 
@@ -297,22 +370,19 @@ def handle_private_message(message:dict, client:'Client', clients:list, server:'
     :type message: dict
     :param client: The client.
     :type client: 'Client'
-    :param clients: The list of all clients.
-    :type clients: list
+    :param clients: The registry of all clients.
+    :type clients: ClientRegistry
     :param server: The server.
     :type server: 'Server'
     :raises Exception: If there is an error during handling the private message
     """
     if client.login:
-        ## Find the recipient client
-        to_user = None
-        for cl in clients:
-            if cl.name == message['to']:
-                to_user = cl
-                break
+        ## Find the recipient, connected to this server or, with other servers, to any of them
+        to_name = message['to']
+        to_user = clients.by_name(to_name)
 
         ## If recipient found
-        if to_user is not None:
+        if to_user is not None or (server.bus is not None and server.database.user_exists(to_name)):
             ## Check if sender is valid
             if client.state != "valid":
                 response = json.dumps({'type':'private',
@@ -320,16 +390,24 @@ def handle_private_message(message:dict, client:'Client', clients:list, server:'
                                        'reason':'not_valid_sender'})
                 client.send(response)
             else:
-                room = ''.join(sorted([client.name, to_user.name]))
+                room = ''.join(sorted([client.name, to_name]))
 
                 ## If room doesn't exist, create it
-                if not server.database.room_exists(room):
+                if not server.room_catalog.exists(room):
                     try:
                         server.database.execute_sql_query("INSERT INTO rooms (name, type) VALUES (:name, :type)",
                                                           {'name':room,
                                                            'type':'private'})
+                        server.register_room(room, 'private')
+                        ## The recipient joins the room on the server it is connected to
                         client.addroom(server, room)
-                        to_user.addroom(server, room)
+                        if not server.add_member(to_name, room) and to_user is None:
+                            ## The room is in the database, the recipient gets it when it logs in again
+                            response = json.dumps({'type':'private',
+                                                   'status':'error',
+                                                   'reason':'recipient_unreachable'})
+                            client.send(response)
+                            return
                     except Exception as e:
                         response = json.dumps({'type':'private',
                                                'status':'error',
@@ -0,0 +1,34 @@
+import pytest
+from server import cache
+from server.cache import LRUCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_least_recently_used_is_evicted(clock):
+    entries = LRUCache(max_size=2)
+    entries.put('a', 1)
+    entries.put('b', 2)
+    assert entries.get('a') == 1
+    entries.put('c', 3)
+    assert entries.get('b') is None and entries.get('a') == 1 and entries.get('c') == 3
+    assert entries.evictions == 1
+
+def test_entries_expire(clock):
+    entries = LRUCache(ttl=10)
+    entries.put('a', 1)
+    clock[0] += 11
+    assert entries.get('a') is None
+
+def test_value_loaded_before_an_invalidation_isnt_cached(clock):
+    entries = LRUCache()
+    generation = entries.generation
+    ## Invalidated while the value was loaded
+    entries.invalidate('a')
+    assert not entries.put('a', 'stale', generation)
+    assert entries.get('a') is None
+    assert entries.put('a', 'fresh', entries.generation)
+    assert entries.get('a') == 'fresh'
@@ -0,0 +1,39 @@
+import os
+import pytest
+from server.framing import FrameDecoder, FrameError, HEADER, encode_frame
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_frames_split_across_reads():
+    decoder = FrameDecoder()
+    frame = encode_frame('{"type": "public", "message": "héllo"}')
+    ## One byte at a time, the header and a multi-byte character are both split
+    messages = []
+    for i in range(len(frame)):
+        messages += decoder.feed(frame[i:i + 1])
+    assert messages == ['{"type": "public", "message": "héllo"}']
+    assert decoder.buffer == bytearray()
+
+def test_several_frames_in_a_read():
+    decoder = FrameDecoder()
+    data = encode_frame("first") + encode_frame("") + encode_frame("second") + encode_frame("third")[:5]
+    assert decoder.feed(data) == ["first", "", "second"]
+    ## The beginning of the last frame is kept for the next read
+    assert decoder.feed(encode_frame("third")[5:]) == ["third"]
+
+def test_oversized_frame():
+    decoder = FrameDecoder(max_size=10)
+    assert decoder.feed(encode_frame("x" * 10)) == ["x" * 10]
+    ## Refused from its header, before the payload is received
+    with pytest.raises(FrameError):
+        decoder.feed(HEADER.pack(11))
+
+def test_invalid_utf8():
+    with pytest.raises(UnicodeDecodeError):
+        FrameDecoder().feed(HEADER.pack(1) + b'\xff')
+
+def test_client_and_server_codecs_are_identical():
+    ## The client and the server are installed apart, each has its copy of the codec
+    with open(os.path.join(ROOT, 'server', 'server', 'framing.py'), 'rb') as server_copy, \
+         open(os.path.join(ROOT, 'client', 'backend', 'framing.py'), 'rb') as client_copy:
+        assert server_copy.read() == client_copy.read(), "framing.py differs between the client and the server"
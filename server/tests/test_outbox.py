@@ -0,0 +1,64 @@
+import threading
+import pytest
+from server.outbox import Outbox, DISCONNECT, DROP_OLDEST
+
+def test_disconnect_policy_refuses_past_high_water():
+    outbox = Outbox(10, DISCONNECT)
+    assert outbox.put(b'12345')
+    assert outbox.put(b'12345')
+    assert not outbox.put(b'1')
+    assert outbox.dropped == 1
+    assert outbox.size == 10 and len(outbox) == 2
+
+def test_frame_bigger_than_high_water_is_queued_alone():
+    outbox = Outbox(4, DISCONNECT)
+    assert outbox.put(b'123456')
+    assert not outbox.put(b'1')
+
+def test_drop_oldest_policy():
+    outbox = Outbox(10, DROP_OLDEST)
+    for frame in (b'aaaa', b'bbbb', b'cccc'):
+        assert outbox.put(frame)
+    assert outbox.dropped == 1
+    assert outbox.pop() == b'bbbb'
+    assert outbox.pop() == b'cccc'
+    assert outbox.pop() is None
+
+def test_frame_being_written_is_counted():
+    outbox = Outbox(100)
+    outbox.put(b'x' * 10)
+    assert outbox.pop() == b'x' * 10
+    ## Popped but not written yet, the client is still behind
+    assert outbox.size == 10 and outbox.stalled() >= 0 and outbox.waiting_since is not None
+    outbox.written(4)
+    assert outbox.size == 6 and outbox.waiting_since is not None
+    outbox.written(6)
+    assert outbox.size == 0 and outbox.stalled() == 0.0
+
+def test_close():
+    outbox = Outbox(100)
+    outbox.put(b'a')
+    outbox.close()
+    assert not outbox.put(b'b')
+    ## The frames queued before are still written
+    assert outbox.get() == b'a'
+    assert outbox.get() is None
+
+def test_close_discarding():
+    outbox = Outbox(100)
+    outbox.put(b'a')
+    outbox.close(discard=True)
+    assert outbox.get() is None and outbox.size == 0
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Outbox(10, 'unknown')
+
+def test_skip_from_several_threads():
+    outbox = Outbox(100)
+    threads = [threading.Thread(target=lambda: [outbox.skip() for _ in range(1000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outbox.skipped == 8000
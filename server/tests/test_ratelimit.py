@@ -0,0 +1,53 @@
+import pytest
+from server import ratelimit
+from server.ratelimit import RateLimiter, TokenBucket
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_bucket_refill_is_capped():
+    bucket = TokenBucket(2, 5)
+    bucket.tokens = 0
+    bucket.refill(bucket.updated + 1)
+    assert bucket.tokens == 2
+    bucket.refill(bucket.updated + 100)
+    assert bucket.tokens == 5
+
+def test_burst_then_rate(clock):
+    limiter = RateLimiter({'public':(1, 3)})
+    assert [limiter.allow('public', 'alice', '10.0.0.1') for _ in range(4)] == [True, True, True, False]
+    clock[0] += 1
+    assert limiter.allow('public', 'alice', '10.0.0.1')
+    assert not limiter.allow('public', 'alice', '10.0.0.1')
+    assert limiter.limited == {'public':2} and limiter.limited_users == 2
+
+def test_other_types_and_users_are_not_limited(clock):
+    limiter = RateLimiter({'public':(1, 1)})
+    assert limiter.allow('public', 'alice', '10.0.0.1')
+    assert limiter.allow('public', 'bob', '10.0.0.1')
+    assert limiter.allow('private', 'alice', '10.0.0.1')
+
+def test_ip_bucket_shared_between_users(clock):
+    limiter = RateLimiter(ip_limits={'signup':(1, 2)})
+    assert limiter.allow('signup', None, '10.0.0.1')
+    assert limiter.allow('signup', None, '10.0.0.1')
+    assert not limiter.allow('signup', None, '10.0.0.1')
+    assert limiter.allow('signup', None, '10.0.0.2')
+    assert limiter.limited_ips == 1
+
+def test_no_token_taken_when_refused(clock):
+    limiter = RateLimiter({'public':(1, 5)}, {'public':(1, 1)})
+    assert limiter.allow('public', 'alice', '10.0.0.1')
+    ## Refused by the bucket of the IP address, the bucket of the user keeps its token
+    assert not limiter.allow('public', 'alice', '10.0.0.1')
+    assert limiter._buckets[('user', 'alice', 'public')].tokens == 4
+
+def test_least_recent_buckets_are_forgotten(clock):
+    limiter = RateLimiter({'public':(1, 1)}, max_buckets=2)
+    for user in ('alice', 'bob', 'carol'):
+        limiter.allow('public', user, '10.0.0.1')
+    assert ('user', 'alice', 'public') not in limiter._buckets
+    assert limiter.allow('public', 'alice', '10.0.0.1')
@@ -0,0 +1,42 @@
+import pytest
+from server.registry import ClientRegistry, RoomIndex
+
+class FakeClient:
+    def __init__(self, name, ip):
+        self.name = name
+        self.ip = (ip, 5000)
+
+def test_room_index_first_and_last_member():
+    calls = []
+    index = RoomIndex(lambda room: calls.append(('first', room)), lambda room: calls.append(('last', room)))
+    alice, bob = FakeClient('alice', '10.0.0.1'), FakeClient('bob', '10.0.0.2')
+    index.join_all(alice, ['a', 'b'])
+    index.join(bob, 'a')
+    assert sorted(index.members('a'), key=lambda client: client.name) == [alice, bob]
+    index.leave_all(alice, ['a', 'b'])
+    assert index.members('a') == [bob] and index.members('b') == []
+    index.leave_all(bob, ['a'])
+    assert calls == [('first', 'a'), ('first', 'b'), ('last', 'b'), ('last', 'a')]
+
+def test_room_index_leave_unknown_room():
+    index = RoomIndex()
+    index.leave_all(FakeClient('alice', '10.0.0.1'), ['nowhere'])
+    assert index.members('nowhere') == []
+
+def test_client_registry_indexes():
+    clients = ClientRegistry()
+    alice, anonymous = FakeClient('alice', '10.0.0.1'), FakeClient('', '10.0.0.1')
+    clients.append(alice)
+    clients.append(anonymous)
+    assert clients.by_name('alice') is alice
+    assert set(clients.by_ip('10.0.0.1')) == {alice, anonymous}
+    assert len(clients) == 2 and alice in clients
+
+    anonymous.name = 'bob'
+    clients.rename(anonymous, '', 'bob')
+    assert clients.by_name('bob') is anonymous
+
+    clients.remove(alice)
+    assert clients.by_name('alice') is None and list(clients) == [anonymous]
+    with pytest.raises(ValueError):
+        clients.remove(alice)